@@ -28,46 +28,42 @@ __license__ = 'Apache License 2.0 (http://www.apache.org/licenses/LICENSE-2.0)'
 import base64
 import codecs
 import collections
+import collections.abc
 import configparser
+import copy
+import csv
 import datetime
-from html.entities import name2codepoint
-from html.parser import HTMLParser
+import hashlib
 import http.client as http_client
 import io
 import json
 import logging
+import mmap
 import os
 import platform
 import random
 import re
+import stat
 import string
 import struct
 import sys
+import threading
 import time
 
-from filelock import FileLock
-
 from gamlib import glapi as API
 from gamlib import glcfg as GC
 from gamlib import glgapi as GAPI
 from gamlib import glglobals as GM
 from gamlib import glmsgs as Msg
 
+# googleapiclient.discovery, googleapiclient.http, google.oauth2, filelock, distro and html.parser are imported when first needed
 import googleapiclient
-import googleapiclient.discovery
 import googleapiclient.errors
-import googleapiclient.http
-import google.oauth2.credentials
-import google.oauth2.id_token
-from google.auth.jwt import Credentials as JWTCredentials
-import google.oauth2.service_account
+import google.auth.exceptions
 import google_auth_httplib2
 import httplib2
 from iso8601 import iso8601
 
-if platform.system() == 'Linux':
-  import distro
-
 def ISOformatTimeStamp(timestamp):
   return timestamp.isoformat('T', 'seconds')
 
@@ -242,48 +238,59 @@ def flushStderr():
   except IOError as e:
     systemErrorExit(FILE_ERROR_RC, e)
 
-class _DeHTMLParser(HTMLParser): #pylint: disable=abstract-method
-  def __init__(self):
-    HTMLParser.__init__(self)
-    self.__text = []
+_DeHTMLParser = None
 
-  def handle_data(self, data):
-    self.__text.append(data)
+def _makeDeHTMLParser():
+  from html.entities import name2codepoint
+  from html.parser import HTMLParser
 
-  def handle_charref(self, name):
-    self.__text.append(chr(int(name[1:], 16)) if name.startswith('x') else chr(int(name)))
+  class DeHTMLParser(HTMLParser): #pylint: disable=abstract-method
+    def __init__(self):
+      HTMLParser.__init__(self)
+      self.__text = []
 
-  def handle_entityref(self, name):
-    cp = name2codepoint.get(name)
-    if cp:
-      self.__text.append(chr(cp))
-    else:
-      self.__text.append('&'+name)
-
-  def handle_starttag(self, tag, attrs):
-    if tag == 'p':
-      self.__text.append('\n\n')
-    elif tag == 'br':
-      self.__text.append('\n')
-    elif tag == 'a':
-      for attr in attrs:
-        if attr[0] == 'href':
-          self.__text.append(f'({attr[1]}) ')
-          break
-    elif tag == 'div':
-      if not attrs:
+    def handle_data(self, data):
+      self.__text.append(data)
+
+    def handle_charref(self, name):
+      self.__text.append(chr(int(name[1:], 16)) if name.startswith('x') else chr(int(name)))
+
+    def handle_entityref(self, name):
+      cp = name2codepoint.get(name)
+      if cp:
+        self.__text.append(chr(cp))
+      else:
+        self.__text.append('&'+name)
+
+    def handle_starttag(self, tag, attrs):
+      if tag == 'p':
+        self.__text.append('\n\n')
+      elif tag == 'br':
         self.__text.append('\n')
-    elif tag in {'http:', 'https'}:
-      self.__text.append(f' ({tag}//{attrs[0][0]}) ')
+      elif tag == 'a':
+        for attr in attrs:
+          if attr[0] == 'href':
+            self.__text.append(f'({attr[1]}) ')
+            break
+      elif tag == 'div':
+        if not attrs:
+          self.__text.append('\n')
+      elif tag in {'http:', 'https'}:
+        self.__text.append(f' ({tag}//{attrs[0][0]}) ')
+
+    def handle_startendtag(self, tag, attrs):
+      if tag == 'br':
+        self.__text.append('\n\n')
 
-  def handle_startendtag(self, tag, attrs):
-    if tag == 'br':
-      self.__text.append('\n\n')
+    def text(self):
+      return re.sub(r'\n{2}\n+', '\n\n', re.sub(r'\n +', '\n', ''.join(self.__text))).strip()
 
-  def text(self):
-    return re.sub(r'\n{2}\n+', '\n\n', re.sub(r'\n +', '\n', ''.join(self.__text))).strip()
+  return DeHTMLParser
 
 def dehtml(text):
+  global _DeHTMLParser
+  if _DeHTMLParser is None:
+    _DeHTMLParser = _makeDeHTMLParser()
   parser = _DeHTMLParser()
   parser.feed(str(text))
   parser.close()
@@ -495,12 +502,58 @@ def formatLocalTime(dateTimeStr):
   except (iso8601.ParseError, OverflowError):
     return dateTimeStr
 
+# Convert a column of time strings; repeated values are only converted once
+def formatLocalTimeList(dateTimeStrList):
+  formattedTimes = {}
+  results = []
+  for dateTimeStr in dateTimeStrList:
+    formattedTime = formattedTimes.get(dateTimeStr)
+    if formattedTime is None:
+      formattedTime = formattedTimes[dateTimeStr] = formatLocalTime(dateTimeStr)
+    results.append(formattedTime)
+  return results
+
 def formatLocalTimestamp(timestamp):
   return ISOformatTimeStamp(datetime.datetime.fromtimestamp(int(timestamp)//1000, GC.Values[GC.TIMEZONE]))
 
 def formatLocalDatestamp(timestamp):
   return datetime.datetime.fromtimestamp(int(timestamp)//1000, GC.Values[GC.TIMEZONE]).strftime(YYYYMMDD_FORMAT)
 
+# NumPy is optional; it is only used for long columns of timestamps in a fixed offset timezone
+NUMPY_MIN_TIMESTAMPS = 1000
+_numpy = False
+
+def _getNumpy():
+  global _numpy
+  if _numpy is False:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = None
+  return _numpy
+
+def _formatLocalTimestampList(timestampList, dateOnly):
+  tz = GC.Values[GC.TIMEZONE]
+  if len(timestampList) >= NUMPY_MIN_TIMESTAMPS and not isinstance(tz, iso8601.LocalTimezone):
+    numpy = _getNumpy()
+    if numpy is not None:
+      seconds = numpy.array([int(timestamp) for timestamp in timestampList], dtype=numpy.int64)//1000+int(tz.utcoffset(None).total_seconds())
+      if dateOnly:
+        return numpy.datetime_as_string(seconds.astype('datetime64[s]').astype('datetime64[D]')).tolist()
+      suffix = ISOformatTimeStamp(datetime.datetime.fromtimestamp(0, tz))[19:]
+      return [f'{timestamp}{suffix}' for timestamp in numpy.datetime_as_string(seconds.astype('datetime64[s]'), unit='s').tolist()]
+  fromtimestamp = datetime.datetime.fromtimestamp
+  if dateOnly:
+    return [fromtimestamp(int(timestamp)//1000, tz).strftime(YYYYMMDD_FORMAT) for timestamp in timestampList]
+  return [ISOformatTimeStamp(fromtimestamp(int(timestamp)//1000, tz)) for timestamp in timestampList]
+
+def formatLocalTimestampList(timestampList):
+  return _formatLocalTimestampList(timestampList, False)
+
+def formatLocalDatestampList(timestampList):
+  return _formatLocalTimestampList(timestampList, True)
+
 def formatHTTPError(http_status, reason, message):
   return f'{http_status}: {reason} - {message}'
 
@@ -664,8 +717,92 @@ def initializeLogging():
   nh = NullHandler()
   logging.getLogger().addHandler(nh)
 
+# A snapshot of the global variables set from a section of gam.cfg is saved in gam.cfg.snapshot;
+# it is discarded when gam.cfg is modified or GAMLite is updated
+FN_SNAPSHOT_SUFFIX = '.snapshot'
+FN_RESOURCE_CATALOGUE_JSON = 'resourcecatalogue.json'
+
+def _encodeSnapshotValue(value):
+  if isinstance(value, bytes):
+    return {'bytes': value.decode(UTF8)}
+  if isinstance(value, datetime.tzinfo):
+    if value is iso8601.UTC:
+      return {'tz': 'utc'}
+    if value is iso8601.Local:
+      return {'tz': 'local'}
+    return {'tz': value.tzname(None)}
+  return value
+
+def _decodeSnapshotValue(value):
+  if isinstance(value, dict):
+    if 'bytes' in value:
+      return bytes(value['bytes'], UTF8)
+    if value['tz'] == 'utc':
+      return iso8601.UTC
+    if value['tz'] == 'local':
+      return iso8601.Local
+    return iso8601.parse_timezone_str(value['tz'])
+  return value
+
+def _getSnapshotKey(configFile):
+  try:
+    st = os.stat(configFile)
+    return {'version': __version__, 'mtime': st.st_mtime_ns, 'size': st.st_size}
+  except OSError:
+    return None
+
+def _readSnapshot(configFile, snapshotKey):
+  try:
+    with open(configFile+FN_SNAPSHOT_SUFFIX, DEFAULT_FILE_READ_MODE, encoding=UTF8) as f:
+      snapshot = json.load(f)
+    if snapshot.get('key') == snapshotKey:
+      return snapshot
+  except (IOError, ValueError):
+    pass
+  return {'key': snapshotKey, 'sections': {}}
+
+def _loadGlobalVariablesSnapshot(configFile, sectionName):
+  snapshotKey = _getSnapshotKey(configFile)
+  if snapshotKey is None:
+    return False
+  section = _readSnapshot(configFile, snapshotKey)['sections'].get(str(sectionName))
+  if not section:
+    return False
+  try:
+    values = {itemName: _decodeSnapshotValue(value) for itemName, value in section['values'].items()}
+  except (iso8601.ParseError, KeyError, OverflowError):
+    return False
+  GC.Values.update(values)
+  GM.Globals[GM.CONVERT_TO_LOCAL_TIME] = section['convertToLocalTime']
+  return True
+
+# Write a private JSON file by replacing it so that readers never see a partial file; errors are ignored
+def writeJSONFileAtomic(fileName, data):
+  tempFileName = f'{fileName}.{os.getpid()}'
+  try:
+    with open(tempFileName, DEFAULT_FILE_WRITE_MODE, encoding=UTF8) as f:
+      json.dump(data, f)
+    os.chmod(tempFileName, 0o600)
+    os.replace(tempFileName, fileName)
+    return True
+  except IOError:
+    try:
+      os.remove(tempFileName)
+    except OSError:
+      pass
+    return False
+
+def _saveGlobalVariablesSnapshot(configFile, sectionName):
+  snapshotKey = _getSnapshotKey(configFile)
+  if snapshotKey is None:
+    return
+  snapshot = _readSnapshot(configFile, snapshotKey)
+  snapshot['sections'][str(sectionName)] = {'values': {itemName: _encodeSnapshotValue(value) for itemName, value in GC.Values.items()},
+                                            'convertToLocalTime': GM.Globals[GM.CONVERT_TO_LOCAL_TIME]}
+  writeJSONFileAtomic(configFile+FN_SNAPSHOT_SUFFIX, snapshot)
+
 # Set global variables from config file
-def SetGlobalVariables(configFile, sectionName=None, config=None, save=False, verify=False):
+def SetGlobalVariables(configFile, sectionName=None, config=None, save=False, verify=False, snapshot=False):
 
   def _stringInQuotes(value):
     return (len(value) > 1) and (((value.startswith('"') and value.endswith('"'))) or ((value.startswith("'") and value.endswith("'"))))
@@ -850,8 +987,32 @@ def SetGlobalVariables(configFile, sectionName=None, config=None, save=False, ve
         continue
       printLine(f'{itemName} = {cfgValue}')
 
+  def _setGlobalEnvironment():
+# Create/set mode for oauth2.txt.lock
+    if not GM.Globals[GM.OAUTH2_TXT_LOCK]:
+      fileName = f'{GC.Values[GC.OAUTH2_TXT]}.lock'
+      if not os.path.isfile(fileName):
+        closeFile(openFile(fileName, mode=DEFAULT_FILE_APPEND_MODE))
+        os.chmod(fileName, 0o666)
+      GM.Globals[GM.OAUTH2_TXT_LOCK] = fileName
+# Override httplib2 settings
+    httplib2.debuglevel = GC.Values[GC.DEBUG_LEVEL]
+# Set environment variables so GData API can find cacerts.pem
+    os.environ['REQUESTS_CA_BUNDLE'] = GC.Values[GC.CACERTS_PEM]
+    os.environ['DEFAULT_CA_BUNDLE_PATH'] = GC.Values[GC.CACERTS_PEM]
+    os.environ['SSL_CERT_FILE'] = GC.Values[GC.CACERTS_PEM]
+    httplib2.CA_CERTS = GC.Values[GC.CACERTS_PEM]
+# Needs to be set so oauthlib doesn't puke when Google changes our scopes
+    os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = 'true'
+    return True
+
   initializeLogging()
   GM.Globals[GM.GAM_CFG_FILE] = configFile
+# snapshot, only used when the config file is not being modified or displayed
+  snapshot = snapshot and not config and not save and not verify
+  if snapshot and _loadGlobalVariablesSnapshot(configFile, sectionName):
+    GM.Globals[GM.DATETIME_NOW] = datetime.datetime.now(GC.Values[GC.TIMEZONE])
+    return _setGlobalEnvironment()
   GM.Globals[GM.PARSER] = configparser.RawConfigParser(defaults=collections.OrderedDict(sorted(list(GC.Defaults.items()), key=lambda t: t[0])))
   _readGamCfgFile(GM.Globals[GM.PARSER], GM.Globals[GM.GAM_CFG_FILE])
   status = {'errors': False}
@@ -920,23 +1081,83 @@ def SetGlobalVariables(configFile, sectionName=None, config=None, save=False, ve
     sys.exit(CONFIG_ERROR_RC)
 # Global values cleanup
   GC.Values[GC.DOMAIN] = GC.Values[GC.DOMAIN].lower()
-# Create/set mode for oauth2.txt.lock
-  if not GM.Globals[GM.OAUTH2_TXT_LOCK]:
-    fileName = f'{GC.Values[GC.OAUTH2_TXT]}.lock'
-    if not os.path.isfile(fileName):
-      closeFile(openFile(fileName, mode=DEFAULT_FILE_APPEND_MODE))
-      os.chmod(fileName, 0o666)
-    GM.Globals[GM.OAUTH2_TXT_LOCK] = fileName
-# Override httplib2 settings
-  httplib2.debuglevel = GC.Values[GC.DEBUG_LEVEL]
-# Set environment variables so GData API can find cacerts.pem
-  os.environ['REQUESTS_CA_BUNDLE'] = GC.Values[GC.CACERTS_PEM]
-  os.environ['DEFAULT_CA_BUNDLE_PATH'] = GC.Values[GC.CACERTS_PEM]
-  os.environ['SSL_CERT_FILE'] = GC.Values[GC.CACERTS_PEM]
-  httplib2.CA_CERTS = GC.Values[GC.CACERTS_PEM]
-# Needs to be set so oauthlib doesn't puke when Google changes our scopes
-  os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = 'true'
-  return True
+  if snapshot:
+    _saveGlobalVariablesSnapshot(configFile, sectionName)
+  return _setGlobalEnvironment()
+
+# Sessions; each session has its own GC.Values and GM.Globals, i.e., config values, credentials,
+# discovery cache and API calls rate check. A thread uses a session while it has entered the session.
+# The shared globals, e.g., the exit status and stdout/stderr, are kept only in the process globals and used by all sessions.
+_sessionThreadData = threading.local()
+SESSION_INITIAL_GLOBALS = copy.deepcopy(GM.Globals)
+SESSION_SHARED_GLOBALS = {GM.GAM_PATH, GM.PID, GM.SAVED_STDOUT, GM.STDERR, GM.STDOUT, GM.SYS_ENCODING, GM.SYSEXITRC, GM.WINDOWS}
+
+class _SessionMapping(collections.abc.MutableMapping):
+  def __init__(self, processValues, sessionAttr, sharedKeys=frozenset()):
+    self.processValues = processValues
+    self.sessionAttr = sessionAttr
+    self.sharedKeys = sharedKeys
+
+  def _getValues(self, key=None):
+    sessions = getattr(_sessionThreadData, 'sessions', None)
+    if sessions and key not in self.sharedKeys:
+      return getattr(sessions[-1], self.sessionAttr)
+    return self.processValues
+
+  def _getSharedKeys(self):
+    return [key for key in self.sharedKeys if key in self.processValues]
+
+  def __getitem__(self, key):
+    return self._getValues(key)[key]
+
+  def __setitem__(self, key, value):
+    self._getValues(key)[key] = value
+
+  def __delitem__(self, key):
+    del self._getValues(key)[key]
+
+  def __iter__(self):
+    values = self._getValues()
+    if values is self.processValues:
+      return iter(values)
+    return iter(list(values)+self._getSharedKeys())
+
+  def __len__(self):
+    values = self._getValues()
+    if values is self.processValues:
+      return len(values)
+    return len(values)+len(self._getSharedKeys())
+
+# GC.Values and GM.Globals are plain dictionaries until the first session is created
+def _installSessionMappings():
+  if not isinstance(GC.Values, _SessionMapping):
+    GC.Values = _SessionMapping(GC.Values, 'values')
+    GM.Globals = _SessionMapping(GM.Globals, 'globals', SESSION_SHARED_GLOBALS)
+
+def getCurrentSession():
+  sessions = getattr(_sessionThreadData, 'sessions', None)
+  return sessions[-1] if sessions else None
+
+class Session():
+  def __init__(self, configFile, sectionName=None, config=None, snapshot=False):
+    _installSessionMappings()
+    self.values = {GC.DEBUG_LEVEL: 0}
+    self.globals = {key: copy.deepcopy(value) for key, value in SESSION_INITIAL_GLOBALS.items() if key not in SESSION_SHARED_GLOBALS}
+    with self:
+      SetGlobalVariables(configFile, sectionName=sectionName, config=config, snapshot=snapshot)
+
+  def __enter__(self):
+    if not hasattr(_sessionThreadData, 'sessions'):
+      _sessionThreadData.sessions = []
+    _sessionThreadData.sessions.append(self)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    _sessionThreadData.sessions.pop()
+
+  def run(self, function, *args, **kwargs):
+    with self:
+      return function(*args, **kwargs)
 
 def handleServerError(e):
   errMsg = str(e)
@@ -1034,6 +1255,7 @@ def handleOAuthTokenError(e, softErrors):
   APIAccessDeniedExit()
 
 def getOauth2TxtCredentials(exitOnError=True, api=None, refreshOnly=False):
+  import google.oauth2.credentials
   jsonData = readFile(GC.Values[GC.OAUTH2_TXT], continueOnError=True, displayError=False)
   if jsonData:
     try:
@@ -1098,6 +1320,7 @@ def getOauth2TxtCredentials(exitOnError=True, api=None, refreshOnly=False):
   return (None, None)
 
 def _getValueFromOAuth(field, credentials=None):
+  import google.oauth2.id_token
   if not GM.Globals[GM.DECODED_ID_TOKEN]:
     request = transportCreateRequest()
     if credentials is None:
@@ -1108,6 +1331,7 @@ def _getValueFromOAuth(field, credentials=None):
   return GM.Globals[GM.DECODED_ID_TOKEN].get(field, 'Unknown')
 
 def writeClientCredentials(creds, filename):
+  import google.oauth2.id_token
   creds_data = {
     'client_id': creds.client_id,
     'client_secret': creds.client_secret,
@@ -1138,6 +1362,7 @@ def getClientCredentials(forceRefresh=False, forceWrite=False, filename=None, ap
   """Gets OAuth2 credentials which are guaranteed to be fresh and valid.
      Locks during read and possible write so that only one process will
      attempt refresh/write when running in parallel. """
+  from filelock import FileLock
   lock = FileLock(GM.Globals[GM.OAUTH2_TXT_LOCK])
   with lock:
     writeCreds, credentials = getOauth2TxtCredentials(api=api, refreshOnly=refreshOnly)
@@ -1184,14 +1409,18 @@ def clearServiceCache(service):
     return True
   return False
 
-DISCOVERY_URIS = [googleapiclient.discovery.V1_DISCOVERY_URI, googleapiclient.discovery.V2_DISCOVERY_URI]
+def getDiscoveryServiceUrl(v2discovery):
+  import googleapiclient.discovery
+  return googleapiclient.discovery.V2_DISCOVERY_URI if v2discovery else googleapiclient.discovery.V1_DISCOVERY_URI
 
 def getAPIService(api, httpObj):
+  import googleapiclient.discovery
   api, version, v2discovery = API.getVersion(api)
   return googleapiclient.discovery.build(api, version, http=httpObj, cache_discovery=False,
-                                         discoveryServiceUrl=DISCOVERY_URIS[v2discovery])
+                                         discoveryServiceUrl=getDiscoveryServiceUrl(v2discovery))
 
 def getService(api, httpObj):
+  import googleapiclient.discovery
   hasLocalJSON = API.hasLocalJSON(api)
   api, version, v2discovery = API.getVersion(api)
   if api in GM.Globals[GM.CURRENT_API_SERVICES] and version in GM.Globals[GM.CURRENT_API_SERVICES][api]:
@@ -1204,7 +1433,7 @@ def getService(api, httpObj):
     for n in range(1, retries+1):
       try:
         service = googleapiclient.discovery.build(api, version, http=httpObj, cache_discovery=False,
-                                                  discoveryServiceUrl=DISCOVERY_URIS[v2discovery])
+                                                  discoveryServiceUrl=getDiscoveryServiceUrl(v2discovery))
         GM.Globals[GM.CURRENT_API_SERVICES].setdefault(api, {})
         GM.Globals[GM.CURRENT_API_SERVICES][api][version] = service._rootDesc.copy()
         if GM.Globals[GM.CACHE_DISCOVERY_ONLY]:
@@ -1283,6 +1512,8 @@ def _getSvcAcctData():
       GM.Globals[GM.SVCACCT_SCOPES] = GM.Globals[GM.OAUTH2SERVICE_JSON_DATA].pop(API.OAUTH2SA_SCOPES)
 
 def getSvcAcctCredentials(scopesOrAPI, userEmail):
+  from google.auth.jwt import Credentials as JWTCredentials
+  import google.oauth2.service_account
   _getSvcAcctData()
   if isinstance(scopesOrAPI, str):
     GM.Globals[GM.CURRENT_SVCACCT_API] = scopesOrAPI
@@ -1321,7 +1552,105 @@ def getSvcAcctCredentials(scopesOrAPI, userEmail):
 
 HTML_TITLE_PATTERN = re.compile(r'.*<title>(.+)</title>')
 
+# checkGAPIError rules by HTTP status, tried in order: (statuses, prefixes, substrings, reason, message)
+# A rule applies when the error status is in statuses or the lowercased message
+# starts with one of prefixes or contains one of substrings; a message of None keeps the original message
+GAPI_CONTENT_QUOTA_RULES = {
+  '403': [((), ('request rate higher than configured',), (), GAPI.QUOTA_EXCEEDED, None)],
+  '429': [((), ('quota exceeded for quota metric',), (), GAPI.QUOTA_EXCEEDED, None)],
+  '502': [((), (), ('bad gateway',), GAPI.BAD_GATEWAY, None)],
+  '503': [((), ('quota exceeded for the current request',), (), GAPI.QUOTA_EXCEEDED, None)],
+  '504': [((), (), ('gateway timeout',), GAPI.GATEWAY_TIMEOUT, None)],
+  }
+GAPI_CONTENT_ERROR_RULES = {
+  '400': [
+    ((), (), ('invalidssosigningkey',), GAPI.INVALID, 'InvalidSsoSigningKey'),
+    ((), (), ('unknownerror',), GAPI.INVALID, 'UnknownError'),
+    ((), (), ('featureunavailableforuser',), GAPI.SERVICE_NOT_AVAILABLE, 'Feature Unavailable For User'),
+    ((), (), ('entitydoesnotexist',), GAPI.NOT_FOUND, 'Entity Does Not Exist'),
+    ((), (), ('entitynamenotvalid',), GAPI.INVALID_INPUT, 'Entity Name Not Valid'),
+    ((), (), ('failed to parse content-range header',), GAPI.BAD_REQUEST, 'Failed to parse Content-Range header'),
+    ((), (), ('request contains an invalid argument',), GAPI.INVALID_ARGUMENT, 'Request contains an invalid argument'),
+    ],
+  '403': [
+    ((), (), ('invalid domain.',), GAPI.NOT_FOUND, 'Domain not found'),
+    ((), (), ('domain cannot use apis.',), GAPI.DOMAIN_CANNOT_USE_APIS, 'Domain cannot use apis'),
+    ],
+  '404': [
+    ((), (), ('not found',), GAPI.NOT_FOUND, None),
+    ((), (), ('bad request',), GAPI.BAD_REQUEST, None),
+    ],
+  }
+GAPI_MESSAGE_ERROR_RULES = {
+  400: [
+    ((), (), ('@attachmentnotvisible',), GAPI.BAD_REQUEST, None),
+    (('FAILED_PRECONDITION',), (), ('precondition check failed',), GAPI.FAILED_PRECONDITION, None),
+    (('INVALID_ARGUMENT',), (), (), GAPI.INVALID_ARGUMENT, None),
+    ((), (), ('does not match', 'invalid'), GAPI.INVALID, None),
+    ],
+  403: [
+    (('PERMISSION_DENIED',), (), ('the caller does not have permission', 'permission iam.serviceaccountkeys'), GAPI.PERMISSION_DENIED, None),
+    ],
+  404: [
+    (('NOT_FOUND',), (), ('requested entity was not found', 'does not exist'), GAPI.NOT_FOUND, None),
+    ],
+  409: [
+    (('ALREADY_EXISTS',), (), ('requested entity already exists',), GAPI.ALREADY_EXISTS, None),
+    ],
+  412: [
+    ((), (), ('insufficient archived user licenses',), GAPI.INSUFFICIENT_ARCHIVED_USER_LICENSES, None),
+    ],
+  429: [
+    (('RESOURCE_EXHAUSTED',), (), ('quota exceeded',), GAPI.QUOTA_EXCEEDED, None),
+    ],
+  500: [
+    ((), (), ('backend error',), GAPI.BACKEND_ERROR, None),
+    ((), (), ('internal error encountered',), GAPI.INTERNAL_ERROR, None),
+    ((), (), ('role assignment exists: roleassignment', 'role assignment exists: roleid'), GAPI.DUPLICATE, None),
+    ((), (), ('operation not supported',), GAPI.OPERATION_NOT_SUPPORTED, None),
+    ((), (), ('failed status in update settings response',), GAPI.INVALID_INPUT, None),
+    (('INTERNAL',), (), (), GAPI.INTERNAL_ERROR, None),
+    ],
+  502: [
+    ((), (), ('bad gateway',), GAPI.BAD_GATEWAY, None),
+    ],
+  503: [
+    (('UNAVAILABLE',), (), ('the service is currently unavailable',), GAPI.SERVICE_NOT_AVAILABLE, None),
+    ((), ('quota exceeded for the current request',), (), GAPI.QUOTA_EXCEEDED, None),
+    ],
+  504: [
+    ((), (), ('gateway timeout',), GAPI.GATEWAY_TIMEOUT, None),
+    ],
+  }
+
+def matchGAPIErrorRule(rules, status, lmessage):
+  for rule in rules:
+    if status in rule[0] or lmessage.startswith(rule[1]):
+      return rule
+    for match in rule[2]:
+      if match in lmessage:
+        return rule
+  return None
+
+# Error storms return the same error content over and over, remember how it was classified
+GAPI_ERROR_RESULTS = {}
+GAPI_ERROR_RESULTS_MAX_SIZE = 1000
+
 def checkGAPIError(e, softErrors=False, retryOnHttpError=False, mapNotFound=True):
+  if GC.Values[GC.DEBUG_LEVEL] > 0:
+    return _checkGAPIError(e, softErrors, retryOnHttpError, mapNotFound)
+  key = (e.resp['status'], e.content, softErrors, retryOnHttpError, mapNotFound)
+  result = GAPI_ERROR_RESULTS.get(key)
+  if result is None:
+    result = _checkGAPIError(e, softErrors, retryOnHttpError, mapNotFound)
+# Soft errors that are not classified have been reported by _checkGAPIError and are not remembered
+    if result[0] != 0:
+      if len(GAPI_ERROR_RESULTS) >= GAPI_ERROR_RESULTS_MAX_SIZE:
+        GAPI_ERROR_RESULTS.clear()
+      GAPI_ERROR_RESULTS[key] = result
+  return result
+
+def _checkGAPIError(e, softErrors, retryOnHttpError, mapNotFound):
   def makeErrorDict(code, reason, message):
     return {'error': {'code': code, 'errors': [{'reason': reason, 'message': message}]}}
 
@@ -1335,41 +1664,15 @@ def checkGAPIError(e, softErrors=False, retryOnHttpError=False, mapNotFound=True
     if GC.Values[GC.DEBUG_LEVEL] > 0:
       writeStdout(f'{ERROR_PREFIX} HTTP: {str(eContent)}\n')
     if eContent[0:15] != b'<!DOCTYPE html>':
-      if (e.resp['status'] == '403') and (lContent.startswith('request rate higher than configured')):
-        return (e.resp['status'], GAPI.QUOTA_EXCEEDED, eContent)
-      if (e.resp['status'] == '429') and (lContent.startswith('quota exceeded for quota metric')):
-        return (e.resp['status'], GAPI.QUOTA_EXCEEDED, eContent)
-      if (e.resp['status'] == '502') and ('bad gateway' in lContent):
-        return (e.resp['status'], GAPI.BAD_GATEWAY, eContent)
-      if (e.resp['status'] == '503') and (lContent.startswith('quota exceeded for the current request')):
-        return (e.resp['status'], GAPI.QUOTA_EXCEEDED, eContent)
-      if (e.resp['status'] == '504') and ('gateway timeout' in lContent):
-        return (e.resp['status'], GAPI.GATEWAY_TIMEOUT, eContent)
+      rule = matchGAPIErrorRule(GAPI_CONTENT_QUOTA_RULES.get(e.resp['status'], []), '', lContent)
+      if rule:
+        return (e.resp['status'], rule[3], eContent)
     else:
       tg = HTML_TITLE_PATTERN.match(lContent)
       lContent = tg.group(1) if tg else 'bad request'
-    if (e.resp['status'] == '403') and ('invalid domain.' in lContent):
-      error = makeErrorDict(403, GAPI.NOT_FOUND, 'Domain not found')
-    elif (e.resp['status'] == '403') and ('domain cannot use apis.' in lContent):
-      error = makeErrorDict(403, GAPI.DOMAIN_CANNOT_USE_APIS, 'Domain cannot use apis')
-    elif (e.resp['status'] == '400') and ('invalidssosigningkey' in lContent):
-      error = makeErrorDict(400, GAPI.INVALID, 'InvalidSsoSigningKey')
-    elif (e.resp['status'] == '400') and ('unknownerror' in lContent):
-      error = makeErrorDict(400, GAPI.INVALID, 'UnknownError')
-    elif (e.resp['status'] == '400') and ('featureunavailableforuser' in lContent):
-      error = makeErrorDict(400, GAPI.SERVICE_NOT_AVAILABLE, 'Feature Unavailable For User')
-    elif (e.resp['status'] == '400') and ('entitydoesnotexist' in lContent):
-      error = makeErrorDict(400, GAPI.NOT_FOUND, 'Entity Does Not Exist')
-    elif (e.resp['status'] == '400') and ('entitynamenotvalid' in lContent):
-      error = makeErrorDict(400, GAPI.INVALID_INPUT, 'Entity Name Not Valid')
-    elif (e.resp['status'] == '400') and ('failed to parse Content-Range header' in lContent):
-      error = makeErrorDict(400, GAPI.BAD_REQUEST, 'Failed to parse Content-Range header')
-    elif (e.resp['status'] == '400') and ('request contains an invalid argument' in lContent):
-      error = makeErrorDict(400, GAPI.INVALID_ARGUMENT, 'Request contains an invalid argument')
-    elif (e.resp['status'] == '404') and ('not found' in lContent):
-      error = makeErrorDict(404, GAPI.NOT_FOUND, lContent)
-    elif (e.resp['status'] == '404') and ('bad request' in lContent):
-      error = makeErrorDict(404, GAPI.BAD_REQUEST, lContent)
+    rule = matchGAPIErrorRule(GAPI_CONTENT_ERROR_RULES.get(e.resp['status'], []), '', lContent)
+    if rule:
+      error = makeErrorDict(int(e.resp['status']), rule[3], rule[4] or lContent)
     elif retryOnHttpError:
       return (-1, None, eContent)
     elif softErrors:
@@ -1386,59 +1689,13 @@ def checkGAPIError(e, softErrors=False, retryOnHttpError=False, mapNotFound=True
       message = error['error']['message']
       status = error['error'].get('status', '')
     lmessage = message.lower() if message is not None else ''
-    if http_status == 500:
-      if not lmessage:
-        message = Msg.UNKNOWN
-        error = makeErrorDict(http_status, GAPI.UNKNOWN_ERROR, message)
-      elif 'backend error' in lmessage:
-        error = makeErrorDict(http_status, GAPI.BACKEND_ERROR, message)
-      elif 'internal error encountered' in lmessage:
-        error = makeErrorDict(http_status, GAPI.INTERNAL_ERROR, message)
-      elif 'role assignment exists: roleassignment' in lmessage:
-        error = makeErrorDict(http_status, GAPI.DUPLICATE, message)
-      elif 'role assignment exists: roleid' in lmessage:
-        error = makeErrorDict(http_status, GAPI.DUPLICATE, message)
-      elif 'operation not supported' in lmessage:
-        error = makeErrorDict(http_status, GAPI.OPERATION_NOT_SUPPORTED, message)
-      elif 'failed status in update settings response' in lmessage:
-        error = makeErrorDict(http_status, GAPI.INVALID_INPUT, message)
-      elif status == 'INTERNAL':
-        error = makeErrorDict(http_status, GAPI.INTERNAL_ERROR, message)
-    elif http_status == 502:
-      if 'bad gateway' in lmessage:
-        error = makeErrorDict(http_status, GAPI.BAD_GATEWAY, message)
-    elif http_status == 503:
-      if status == 'UNAVAILABLE' or 'the service is currently unavailable' in lmessage:
-        error = makeErrorDict(http_status, GAPI.SERVICE_NOT_AVAILABLE, message)
-      elif message.startswith('quota exceeded for the current request'):
-        error = makeErrorDict(http_status, GAPI.QUOTA_EXCEEDED, message)
-    elif http_status == 504:
-      if 'gateway timeout' in lmessage:
-        error = makeErrorDict(http_status, GAPI.GATEWAY_TIMEOUT, message)
-    elif http_status == 400:
-      if '@attachmentnotvisible' in lmessage:
-        error = makeErrorDict(http_status, GAPI.BAD_REQUEST, message)
-      elif status == 'FAILED_PRECONDITION' or 'precondition check failed' in lmessage:
-        error = makeErrorDict(http_status, GAPI.FAILED_PRECONDITION, message)
-      elif status == 'INVALID_ARGUMENT':
-        error = makeErrorDict(http_status, GAPI.INVALID_ARGUMENT, message)
-      elif 'does not match' in lmessage or 'invalid' in lmessage:
-        error = makeErrorDict(http_status, GAPI.INVALID, message)
-    elif http_status == 403:
-      if status == 'PERMISSION_DENIED' or 'the caller does not have permission' in lmessage or 'permission iam.serviceaccountkeys' in lmessage:
-        error = makeErrorDict(http_status, GAPI.PERMISSION_DENIED, message)
-    elif http_status == 404:
-      if status == 'NOT_FOUND' or 'requested entity was not found' in lmessage or 'does not exist' in lmessage:
-        error = makeErrorDict(http_status, GAPI.NOT_FOUND, message)
-    elif http_status == 409:
-      if status == 'ALREADY_EXISTS' or 'requested entity already exists' in lmessage:
-        error = makeErrorDict(http_status, GAPI.ALREADY_EXISTS, message)
-    elif http_status == 412:
-      if 'insufficient archived user licenses' in lmessage:
-        error = makeErrorDict(http_status, GAPI.INSUFFICIENT_ARCHIVED_USER_LICENSES, message)
-    elif http_status == 429:
-      if status == 'RESOURCE_EXHAUSTED' or 'quota exceeded' in lmessage:
-        error = makeErrorDict(http_status, GAPI.QUOTA_EXCEEDED, message)
+    if http_status == 500 and not lmessage:
+      message = Msg.UNKNOWN
+      error = makeErrorDict(http_status, GAPI.UNKNOWN_ERROR, message)
+    else:
+      rule = matchGAPIErrorRule(GAPI_MESSAGE_ERROR_RULES.get(http_status, []), status, lmessage)
+      if rule:
+        error = makeErrorDict(http_status, rule[3], message)
   else:
     if 'error_description' in error:
       if error['error_description'] == 'Invalid Value':
@@ -1471,7 +1728,7 @@ def checkGAPIError(e, softErrors=False, retryOnHttpError=False, mapNotFound=True
 
 def callGAPI(service, function,
              bailOnInternalError=False, bailOnTransientError=False, softErrors=False, mapNotFound=True,
-             throwReasons=None, retryReasons=None, retries=10,
+             throwReasons=None, retryReasons=None, retries=10, requestHeaders=None,
              **kwargs):
   if throwReasons is None:
     throwReasons = []
@@ -1484,7 +1741,11 @@ def callGAPI(service, function,
     checkAPICallsRate()
   for n in range(1, retries+1):
     try:
-      return method(**svcparms).execute()
+      if not requestHeaders:
+        return method(**svcparms).execute()
+      request = method(**svcparms)
+      request.headers.update(requestHeaders)
+      return request.execute()
     except googleapiclient.errors.HttpError as e:
       http_status, reason, message = checkGAPIError(e, softErrors=softErrors, retryOnHttpError=n < 3, mapNotFound=mapNotFound)
       if http_status == -1:
@@ -1559,9 +1820,75 @@ def _processGAPIpagesResult(results, items, allResults, totalItems):
     pageItems = 0
   return (pageToken, totalItems)
 
+# Checkpoint for paged calls; a JSON line identifying the call followed by a JSON line for each completed page
+# {"function": "<Name>", "items": "<Name>", "kwargs": {...}}
+# {"pageToken": "<NextPageToken>", "totalItems": <Number>, "items": [...]}; items are only saved for callGAPIpages
+class GAPIpagesCheckpoint():
+  def __init__(self, checkpointFile, function, items, kwargs, saveItems):
+    self.checkpointFile = os.path.expanduser(checkpointFile)
+    self.saveItems = saveItems
+    self.call = json.loads(json.dumps({'function': function, 'items': items,
+                                       'kwargs': {k: v for k, v in kwargs.items() if k != 'pageToken'}}, default=str))
+    self.f = None
+
+# Returns (pageToken, totalItems, savedItems) of the last completed page; a partially written last line is discarded
+  def load(self):
+    pageToken = None
+    totalItems = 0
+    savedItems = []
+    validLength = 0
+    if os.path.isfile(self.checkpointFile):
+      f = openFile(self.checkpointFile, 'rb', continueOnError=True)
+      if f:
+        length = 0
+        for lineNum, line in enumerate(f):
+          length += len(line)
+          try:
+            record = json.loads(line) if line.endswith(b'\n') else None
+          except ValueError:
+            record = None
+          if record is None or (lineNum == 0 and record != self.call):
+            break
+          if lineNum > 0:
+            pageToken = record['pageToken']
+            totalItems = record['totalItems']
+            if self.saveItems:
+              savedItems.extend(record.get('items', []))
+          validLength = length
+        closeFile(f)
+    if validLength:
+      os.truncate(self.checkpointFile, validLength)
+      self.f = openFile(self.checkpointFile, DEFAULT_FILE_APPEND_MODE, encoding=UTF8)
+    else:
+      self.f = openFile(self.checkpointFile, DEFAULT_FILE_WRITE_MODE, encoding=UTF8)
+      self._write(self.call)
+    return (pageToken, totalItems, savedItems)
+
+  def _write(self, record):
+    self.f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)+'\n')
+    self.f.flush()
+    os.fsync(self.f.fileno())
+
+  def commit(self, pageToken, totalItems, pageItems=None):
+    record = {'pageToken': pageToken, 'totalItems': totalItems}
+    if self.saveItems:
+      record['items'] = pageItems or []
+    self._write(record)
+
+  def close(self):
+    if self.f:
+      closeFile(self.f)
+      self.f = None
+
+  def finish(self):
+    self.close()
+    if os.path.isfile(self.checkpointFile):
+      os.remove(self.checkpointFile)
+
 def callGAPIpages(service, function, items,
                   maxItems=0,
                   throwReasons=None, retryReasons=None,
+                  checkpointFile=None,
                   **kwargs):
   if throwReasons is None:
     throwReasons = []
@@ -1571,16 +1898,73 @@ def callGAPIpages(service, function, items,
   totalItems = 0
   maxResults = kwargs.get('maxResults', 0)
   tweakMaxResults = maxItems and maxResults
-  while True:
-    if tweakMaxResults and maxItems-totalItems < maxResults:
-      kwargs['maxResults'] = maxItems-totalItems
-    results = callGAPI(service, function,
-                       throwReasons=throwReasons, retryReasons=retryReasons,
-                       **kwargs)
-    pageToken, totalItems = _processGAPIpagesResult(results, items, allResults, totalItems)
-    if not pageToken or (maxItems and totalItems >= maxItems):
-      return allResults
-    kwargs['pageToken'] = pageToken
+  checkpoint = None
+  if checkpointFile:
+    checkpoint = GAPIpagesCheckpoint(checkpointFile, function, items, kwargs, True)
+    pageToken, totalItems, allResults = checkpoint.load()
+    if pageToken:
+      kwargs['pageToken'] = pageToken
+  try:
+    while True:
+      if tweakMaxResults and maxItems-totalItems < maxResults:
+        kwargs['maxResults'] = maxItems-totalItems
+      results = callGAPI(service, function,
+                         throwReasons=throwReasons, retryReasons=retryReasons,
+                         **kwargs)
+      pageStart = len(allResults)
+      pageToken, totalItems = _processGAPIpagesResult(results, items, allResults, totalItems)
+      if not pageToken or (maxItems and totalItems >= maxItems):
+        if checkpoint:
+          checkpoint.finish()
+        return allResults
+      if checkpoint:
+        checkpoint.commit(pageToken, totalItems, allResults[pageStart:])
+      kwargs['pageToken'] = pageToken
+  finally:
+    if checkpoint:
+      checkpoint.close()
+
+# Generator version of callGAPIpages, yields the items one at a time.
+# With a checkpoint file, a page is committed when the caller asks for the item after its last item,
+# so a restarted call continues after the last page the caller has completely processed
+def yieldGAPIpages(service, function, items,
+                   maxItems=0,
+                   throwReasons=None, retryReasons=None,
+                   checkpointFile=None,
+                   **kwargs):
+  if throwReasons is None:
+    throwReasons = []
+  if retryReasons is None:
+    retryReasons = []
+  totalItems = 0
+  maxResults = kwargs.get('maxResults', 0)
+  tweakMaxResults = maxItems and maxResults
+  checkpoint = None
+  if checkpointFile:
+    checkpoint = GAPIpagesCheckpoint(checkpointFile, function, items, kwargs, False)
+    pageToken, totalItems, _ = checkpoint.load()
+    if pageToken:
+      kwargs['pageToken'] = pageToken
+  try:
+    while True:
+      if tweakMaxResults and maxItems-totalItems < maxResults:
+        kwargs['maxResults'] = maxItems-totalItems
+      results = callGAPI(service, function,
+                         throwReasons=throwReasons, retryReasons=retryReasons,
+                         **kwargs)
+      pageResults = []
+      pageToken, totalItems = _processGAPIpagesResult(results, items, pageResults, totalItems)
+      yield from pageResults
+      if not pageToken or (maxItems and totalItems >= maxItems):
+        if checkpoint:
+          checkpoint.finish()
+        return
+      if checkpoint:
+        checkpoint.commit(pageToken, totalItems)
+      kwargs['pageToken'] = pageToken
+  finally:
+    if checkpoint:
+      checkpoint.close()
 
 def callGAPIitems(service, function, items,
                   throwReasons=None, retryReasons=None,
@@ -1596,6 +1980,135 @@ def callGAPIitems(service, function, items,
     return results.get(items, [])
   return []
 
+# Execute requests in batches; requests is a list of (key, request) where request is an unexecuted API request,
+# e.g. (userId, cd.users().get(userKey=userId)), and service is the API service object that made the requests.
+# Requests that fail with a retry reason are retried in later batches.
+# Returns (results, errors): {key: result} and {key: (http_status, reason, message)}
+def callGAPIbatch(service, requests,
+                  batchSize=None, retryReasons=None, retries=10):
+  def _callback(requestId, response, exception):
+    key, request = batchRequests[int(requestId)]
+    if exception is None:
+      results[key] = response
+      return
+    if isinstance(exception, googleapiclient.errors.HttpError):
+      http_status, reason, message = checkGAPIError(exception, softErrors=True, retryOnHttpError=True)
+    else:
+      http_status, reason, message = (0, None, str(exception))
+    if http_status == -1 or reason in allRetryReasons:
+      retryRequests.append((key, request))
+      lastError[0] = reason or http_status
+      lastError[1] = message
+    else:
+      errors[key] = (http_status, reason, message)
+
+  if retryReasons is None:
+    retryReasons = []
+  allRetryReasons = GAPI.DEFAULT_RETRY_REASONS+retryReasons
+  batchSize = min(batchSize or GC.Values[GC.BATCH_SIZE], 1000)
+  results = {}
+  errors = {}
+  lastError = [None, None]
+  pending = list(requests)
+  for n in range(1, retries+1):
+    retryRequests = []
+    for i in range(0, len(pending), batchSize):
+      batchRequests = pending[i:i+batchSize]
+      dbatch = service.new_batch_http_request(callback=_callback)
+      for j, (_, request) in enumerate(batchRequests):
+        dbatch.add(request, request_id=str(j))
+        if GC.Values[GC.API_CALLS_RATE_CHECK]:
+          checkAPICallsRate()
+      try:
+        executeBatch(dbatch)
+      except (httplib2.HttpLib2Error, google.auth.exceptions.TransportError, http_client.ResponseNotReady, OSError) as e:
+        service._http.connections = {}
+        retryKeys = {key for key, _ in retryRequests}
+        retryRequests.extend([(key, request) for key, request in batchRequests
+                              if key not in results and key not in errors and key not in retryKeys])
+        lastError[0] = NETWORK_ERROR_RC
+        lastError[1] = str(e) or repr(e)
+    if not retryRequests:
+      break
+    if n == retries:
+      for key, _ in retryRequests:
+        errors[key] = (0, lastError[0], lastError[1])
+      break
+    waitOnFailure(n, retries, lastError[0], lastError[1])
+    pending = retryRequests
+  return (results, errors)
+
+def getMediaMimeType(mediaFile):
+  import mimetypes
+
+  return mimetypes.guess_type(mediaFile)[0] or 'application/octet-stream'
+
+# Resumable media upload; mediaFile is memory mapped and uploaded in chunks of chunkSize (default upload_chunk_size) MB.
+# A chunk that fails with a retry reason or a network error is retried with next_chunk, which first asks the server
+# for the last byte it received; the retry count is reset after each acknowledged chunk.
+# If the upload session has expired, the upload is restarted with a new request
+def callGAPIupload(service, function, mediaFile, mimeType=None,
+                   chunkSize=None, throwReasons=None, retryReasons=None, retries=10,
+                   **kwargs):
+  import googleapiclient.http
+
+  if throwReasons is None:
+    throwReasons = []
+  if retryReasons is None:
+    retryReasons = []
+  allRetryReasons = GAPI.DEFAULT_RETRY_REASONS+retryReasons
+  method = getattr(service, function)
+  svcparms = dict(list(kwargs.items())+GM.Globals[GM.EXTRA_ARGS_LIST])
+  with open(os.path.expanduser(mediaFile), 'rb') as f:
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else io.BytesIO()
+    try:
+      media = googleapiclient.http.MediaIoBaseUpload(data, mimetype=mimeType or getMediaMimeType(mediaFile),
+                                                     chunksize=(chunkSize or GC.Values[GC.UPLOAD_CHUNK_SIZE])*1024*1024, resumable=True)
+      request = method(media_body=media, **svcparms)
+      n = 0
+      while True:
+        if GC.Values[GC.API_CALLS_RATE_CHECK]:
+          checkAPICallsRate()
+        try:
+          _, response = request.next_chunk()
+          if response is not None:
+            return response
+          n = 0
+          continue
+        except googleapiclient.errors.HttpError as e:
+          n += 1
+# A failed upload session start raises ResumableUploadError; 404/410 otherwise means that the session has expired
+          if (e.resp.status in {404, 410} and not isinstance(e, googleapiclient.errors.ResumableUploadError)
+              and n < retries):
+            request = method(media_body=media, **svcparms)
+            continue
+          http_status, reason, message = checkGAPIError(e, retryOnHttpError=n < retries)
+          if n < retries and (http_status == -1 or reason in allRetryReasons):
+            waitOnFailure(n, retries, reason or http_status, message)
+            continue
+          if reason in throwReasons:
+            if reason in GAPI.REASON_EXCEPTION_MAP:
+              raise GAPI.REASON_EXCEPTION_MAP[reason](message)
+            raise e
+          if reason == GAPI.INSUFFICIENT_PERMISSIONS:
+            APIAccessDeniedExit()
+          systemErrorExit(HTTP_ERROR_RC, formatHTTPError(http_status, reason, message))
+        except (httplib2.HttpLib2Error, google.auth.exceptions.TransportError,
+                http_client.ResponseNotReady, OSError) as e:
+          n += 1
+          if n < retries:
+            service._http.connections = {}
+            waitOnFailure(n, retries, NETWORK_ERROR_RC, str(e) or repr(e))
+            continue
+          handleServerError(e)
+        except google.auth.exceptions.RefreshError as e:
+          if isinstance(e.args, tuple):
+            e = e.args[0]
+          handleOAuthTokenError(e, GAPI.SERVICE_NOT_AVAILABLE in throwReasons)
+          raise GAPI.REASON_EXCEPTION_MAP[GAPI.SERVICE_NOT_AVAILABLE](str(e))
+    finally:
+      data.close()
+
 def readDiscoveryFile(api_version):
   disc_filename = f'{api_version}.json'
   disc_file = os.path.join(GM.Globals[GM.GAM_PATH], disc_filename)
@@ -1667,16 +2180,89 @@ def useGAPIServiceObject(gapiServiceObj):
   GM.Globals[GM.CURRENT_SVCACCT_USER] = gapiServiceObj['user']
   return gapiServiceObj['service']
 
+# Service objects are not thread safe; a pool hands out a separate gapiObj to each concurrent user
+class GAPIObjectPool():
+  def __init__(self, *gapiObjs):
+    self.lock = threading.Lock()
+    self.idle = {}
+    for gapiObj in gapiObjs:
+      self.put(gapiObj)
+
+  def get(self, api, user=None):
+    with self.lock:
+      gapiObjs = self.idle.get((api, user))
+      if gapiObjs:
+        return gapiObjs.pop()
+    if user:
+      return buildGAPIServiceObject(api, user, displayError=False)
+    return buildGAPIObject(api)
+
+  def getLike(self, gapiObj):
+    return self.get(gapiObj['api'], gapiObj.get('user'))
+
+  def put(self, gapiObj):
+    if gapiObj:
+      with self.lock:
+        self.idle.setdefault((gapiObj['api'], gapiObj.get('user')), []).append(gapiObj)
+
+# Call function(pooledObj, *args, **kwargs) with a pooledObj like gapiObj from pool; pooledObj is returned to the pool
+# when function returns. Returns an error message if pooledObj can not be built
+def callWithPooledGAPIObject(pool, gapiObj, function, *args, **kwargs):
+  pooledObj = pool.getLike(gapiObj)
+  if not pooledObj:
+    return formatKeyValueList('', [API.getAPIName(gapiObj['api']), gapiObj.get('user') or GC.Values[GC.DOMAIN], Msg.SERVICE_NOT_APPLICABLE], '')
+  result = function(pooledObj, *args, **kwargs)
+  pool.put(pooledObj)
+  return result
+
+# Submit function to executor; it runs in session, the session of the submitting thread, if any
+def submitInSession(executor, session, function, *args, **kwargs):
+  if session is not None:
+    return executor.submit(session.run, function, *args, **kwargs)
+  return executor.submit(function, *args, **kwargs)
+
+# Sync from a saved start token: applyChanges(startToken) when there is one; otherwise, or when it has expired
+# (applyChanges raises one of expiredErrors), listAll(getStartToken()). The start token is read before everything
+# is listed so that changes made while listing are in the next sync
+def _syncFromStartToken(startToken, expiredErrors, applyChanges, getStartToken, listAll):
+  if startToken:
+    try:
+      return applyChanges(startToken)
+    except expiredErrors:
+      pass
+  return listAll(getStartToken())
+
 DEFAULT_SKIP_OBJECTS = {'kind', 'etag', 'etags'}
 
+# Convert the top level time values of a list of objects a column at a time
+def _formatTimeColumns(topStructure, timeObjects):
+  timeStrs = set()
+  timestamps = set()
+  for item in topStructure:
+    if isinstance(item, dict):
+      for key in timeObjects:
+        value = item.get(key)
+        if isinstance(value, str) and not value.isdigit():
+          timeStrs.add(value)
+        elif isinstance(value, (str, int)):
+          timestamps.add(value)
+  timeStrs = list(timeStrs)
+  timestamps = list(timestamps)
+  formattedTimes = dict(zip(timeStrs, formatLocalTimeList(timeStrs)))
+  formattedTimes.update(zip(timestamps, formatLocalTimestampList(timestamps)))
+  return formattedTimes
+
 # Clean a JSON object
 def cleanJSON(topStructure, listLimit=None, skipObjects=None, timeObjects=None):
   def _clean(structure, key):
     if not isinstance(structure, (dict, list)):
       if key not in timeObjects:
-        if isinstance(structure, str) and GC.Values[GC.CSV_OUTPUT_CONVERT_CR_NL]:
+        if isinstance(structure, str) and convertCRsNLs:
           return escapeCRsNLs(structure)
         return structure
+      formattedTime = formattedTimes.get(structure)
+      if formattedTime is not None:
+        return formattedTime
       if isinstance(structure, str) and not structure.isdigit():
         return formatLocalTime(structure)
       return formatLocalTimestamp(structure)
@@ -1687,7 +2273,9 @@ def cleanJSON(topStructure, listLimit=None, skipObjects=None, timeObjects=None):
     return {k: _clean(v, k) for k, v in sorted(iter(structure.items())) if k not in allSkipObjects}
 
   allSkipObjects = DEFAULT_SKIP_OBJECTS.union(skipObjects or set())
+  convertCRsNLs = GC.Values[GC.CSV_OUTPUT_CONVERT_CR_NL]
   timeObjects = timeObjects or set()
+  formattedTimes = _formatTimeColumns(topStructure, timeObjects) if timeObjects and isinstance(topStructure, list) else {}
   return _clean(topStructure, '')
 
 MACOS_CODENAMES = {
@@ -1706,6 +2294,7 @@ MACOS_CODENAMES = {
 def getOSPlatform():
   myos = platform.system()
   if myos == 'Linux':
+    import distro
     pltfrm = ' '.join(distro.linux_distribution(full_distribution_name=False)).title()
   elif myos == 'Windows':
     pltfrm = ' '.join(platform.win32_ver())
@@ -1727,6 +2316,238 @@ def Version():
           f'Path: {GM.Globals[GM.GAM_PATH]}\n'
           )
 
+# Server mode; wrapper functions are called with newline delimited JSON requests on a local socket
+# Request: {"id": <Value>, "function": "<WrapperName>", "user": "<UserEmail>", "args": [...], "kwargs": {...}, "token": "<Token>"}
+#   user is required for Drive and Gmail wrappers, args and kwargs are the wrapper arguments after the gapiObj
+#   token is required on a TCP port, which is not protected by file permissions
+# Response: {"id": <Value>, "result": <WrapperResult>} or {"id": <Value>, "error": "<Message>"}
+SERVER_SOCKET_FILE = 'gam.sock'
+SERVER_LOOPBACK_HOSTS = {'localhost', '127.0.0.1', '::1'}
+SERVER_GAPI_OBJECT_APIS = {'gapiDirObj': API.DIRECTORY, 'gapiDriveObj': API.DRIVE3, 'gapiGmailObj': API.GMAIL}
+
+def _getWrapperAPI(function):
+  code = getattr(function, '__code__', None)
+  if code is None or code.co_argcount == 0:
+    return None
+  return SERVER_GAPI_OBJECT_APIS.get(code.co_varnames[0])
+
+def _getServerFunction(functionName):
+  function = globals().get(functionName) if isinstance(functionName, str) and functionName[:1].isupper() else None
+  api = _getWrapperAPI(function)
+  return (function, api) if api else (None, None)
+
+# Call a wrapper with a pooled gapiObj, returns ('result', <WrapperResult>) or ('error', '<Message>')
+def _callWrapperFunction(pool, function, api, user, args, kwargs):
+  try:
+    gapiObj = pool.get(api, user)
+  except SystemExit:
+    gapiObj = None
+  if not gapiObj:
+    return ('error', formatKeyValueList('', [API.getAPIName(api), user or GC.Values[GC.DOMAIN], Msg.SERVICE_NOT_APPLICABLE], ''))
+  try:
+    result = function(gapiObj, *args, **kwargs)
+# A generator uses gapiObj as it is consumed
+    if isinstance(result, collections.abc.Generator):
+      result = list(result)
+    pool.put(gapiObj)
+    return ('result', result)
+  except SystemExit as e:
+    return ('error', f'Exit: {e.code}')
+  except Exception as e: #pylint: disable=broad-except
+    return ('error', f'{type(e).__name__}: {str(e)}')
+
+def _processServerRequest(pool, line, token=None):
+  import hmac
+
+  try:
+    request = json.loads(line)
+    if not isinstance(request, dict):
+      raise ValueError('Request is not a JSON object')
+  except ValueError as e:
+    return {'id': None, 'error': str(e)}
+  response = {'id': request.get('id')}
+  if token is not None and not hmac.compare_digest(str(request.get('token', '')).encode(UTF8), token.encode(UTF8)):
+    response['error'] = f'{Msg.INVALID} token'
+    return response
+  function, api = _getServerFunction(request.get('function'))
+  if function is None:
+    response['error'] = f'{Msg.UNKNOWN} function: {request.get("function")}'
+    return response
+  user = request.get('user') if api != API.DIRECTORY else None
+  if api != API.DIRECTORY and not user:
+    response['error'] = f'user is required for {request["function"]}'
+    return response
+  key, value = _callWrapperFunction(pool, function, api, user, request.get('args', []), request.get('kwargs', {}))
+  response[key] = value
+  return response
+
+def RunServer(socketPath=None, host=None, port=None, token=None):
+  import secrets
+  import socket
+  import socketserver
+
+  useTCP = host is not None or port is not None or not hasattr(socketserver, 'ThreadingUnixStreamServer')
+  if useTCP:
+    host = host or '127.0.0.1'
+    if host.lower() not in SERVER_LOOPBACK_HOSTS:
+      systemErrorExit(USAGE_ERROR_RC, formatKeyValueList('', ['Server', host, f'{Msg.INVALID} host, only loopback hosts are allowed'], ''))
+    token = token or secrets.token_urlsafe(32)
+  else:
+    socketPath = socketPath or os.path.join(GC.Values[GC.CONFIG_DIR], SERVER_SOCKET_FILE)
+    token = None
+  session = getCurrentSession()
+  pool = GAPIObjectPool()
+
+  class ServerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+      if session is not None:
+        session.__enter__()
+      try:
+        for line in self.rfile:
+          if line.strip():
+            response = _processServerRequest(pool, line, token)
+            self.wfile.write(json.dumps(response, ensure_ascii=False, default=str).encode(UTF8)+b'\n')
+            self.wfile.flush()
+      finally:
+        if session is not None:
+          session.__exit__(None, None, None)
+
+  if not useTCP:
+    if os.path.exists(socketPath) and stat.S_ISSOCK(os.stat(socketPath).st_mode):
+      os.remove(socketPath)
+    umask = os.umask(0o177)
+    try:
+      server = socketserver.ThreadingUnixStreamServer(socketPath, ServerRequestHandler)
+    finally:
+      os.umask(umask)
+    serverAddress = socketPath
+  else:
+    class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+      allow_reuse_address = True
+
+    if ':' in host:
+      ThreadingTCPServer.address_family = socket.AF_INET6
+    server = ThreadingTCPServer((host, port or 0), ServerRequestHandler)
+    serverAddress = f'{server.server_address[0]}:{server.server_address[1]}'
+  server.daemon_threads = True
+  if token is not None:
+    printKeyValueList(['Server', serverAddress, 'Token', token, 'Listening'])
+  else:
+    printKeyValueList(['Server', serverAddress, 'Listening'])
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if not useTCP and os.path.exists(socketPath):
+      os.remove(socketPath)
+
+# CSV job; apply a wrapper to each row of a CSV file, the rows are written to an output CSV file
+# with the job status and wrapper result appended, in input order
+CSV_JOB_STATUS = 'jobStatus'
+CSV_JOB_RESULT = 'jobResult'
+CSV_JOB_STATUS_OK = 'OK'
+CSV_JOB_STATUS_ERROR = 'ERROR'
+CSV_JOB_WINDOW_PER_THREAD = 4
+
+def getCSVInputDialect():
+  return {'delimiter': GC.Values[GC.CSV_INPUT_COLUMN_DELIMITER], 'quotechar': GC.Values[GC.CSV_INPUT_QUOTE_CHAR]}
+
+def getCSVOutputDialect():
+  return {'delimiter': GC.Values[GC.CSV_OUTPUT_COLUMN_DELIMITER], 'quotechar': GC.Values[GC.CSV_OUTPUT_QUOTE_CHAR],
+          'lineterminator': GC.Values[GC.CSV_OUTPUT_LINE_TERMINATOR]}
+
+# Map a row to wrapper kwargs; an argument name of body.name.givenName builds a nested body
+def _makeCSVJobKwargs(row, columnMap, jsonColumns):
+  kwargs = {}
+  for column, argument in columnMap.items():
+    value = row.get(column)
+    if value is None or value == '':
+      continue
+    if column in jsonColumns:
+      value = json.loads(value)
+    keys = argument.split('.')
+    target = kwargs
+    for key in keys[:-1]:
+      target = target.setdefault(key, {})
+    target[keys[-1]] = value
+  return kwargs
+
+def _runCSVJobRow(pool, function, api, user, row, columnMap, jsonColumns, kwargs):
+  try:
+    rowKwargs = _makeCSVJobKwargs(row, columnMap, jsonColumns)
+  except ValueError as e:
+    return (CSV_JOB_STATUS_ERROR, f'{Msg.INVALID} JSON: {str(e)}')
+  rowKwargs.update(kwargs)
+  key, value = _callWrapperFunction(pool, function, api, user, [], rowKwargs)
+  if key == 'error' or isinstance(value, str):
+    return (CSV_JOB_STATUS_ERROR, value)
+  return (CSV_JOB_STATUS_OK, json.dumps(value, ensure_ascii=False, sort_keys=True, default=str))
+
+def _countCSVJobOutputRows(outputFile):
+  if outputFile == '-' or not os.path.isfile(os.path.expanduser(outputFile)):
+    return -1
+  f = openFile(outputFile, newline='')
+  rows = sum(1 for _ in csv.reader(f, **getCSVOutputDialect()))
+  closeFile(f)
+  return rows-1
+
+def RunCSVJob(function, inputFile, outputFile, columnMap=None, jsonColumns=None, userColumn=None,
+              numThreads=None, resume=True, **kwargs):
+  import concurrent.futures
+
+  if isinstance(function, str):
+    function, api = _getServerFunction(function)
+  else:
+    api = _getWrapperAPI(function)
+  if function is None or api is None:
+    return f'{Msg.UNKNOWN} function'
+  if api != API.DIRECTORY and not userColumn:
+    return f'userColumn is required for {function.__name__}'
+  jsonColumns = set(jsonColumns or [])
+  inputF = openFile(inputFile, DEFAULT_CSV_READ_MODE, newline='', stripUTFBOM=True)
+  reader = csv.DictReader(inputF, **getCSVInputDialect())
+  fieldnames = reader.fieldnames or []
+  if columnMap is None:
+    columnMap = {column: column for column in fieldnames if column != userColumn}
+  completed = _countCSVJobOutputRows(outputFile) if resume else -1
+  outputF = openFile(outputFile, DEFAULT_FILE_APPEND_MODE if completed >= 0 else DEFAULT_FILE_WRITE_MODE, newline='')
+  writer = csv.DictWriter(outputF, fieldnames+[CSV_JOB_STATUS, CSV_JOB_RESULT], restval='', extrasaction='ignore',
+                          **getCSVOutputDialect())
+  if completed < 0:
+    writer.writeheader()
+  stats = {'skipped': max(completed, 0), 'ok': 0, 'error': 0}
+  session = getCurrentSession()
+  pool = GAPIObjectPool()
+  numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+  window = collections.deque()
+
+  def _writeRow(row, future):
+    row[CSV_JOB_STATUS], row[CSV_JOB_RESULT] = future.result()
+    stats['ok' if row[CSV_JOB_STATUS] == CSV_JOB_STATUS_OK else 'error'] += 1
+    writer.writerow(row)
+
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+      for rowNum, row in enumerate(reader):
+        if rowNum < stats['skipped']:
+          continue
+        user = row.get(userColumn) if api != API.DIRECTORY else None
+        future = submitInSession(executor, session, _runCSVJobRow, pool, function, api, user, row, columnMap, jsonColumns, kwargs)
+        window.append((row, future))
+        if len(window) >= numThreads*CSV_JOB_WINDOW_PER_THREAD:
+          _writeRow(*window.popleft())
+          outputF.flush()
+      while window:
+        _writeRow(*window.popleft())
+  finally:
+    for _, future in window:
+      future.cancel()
+    closeFile(inputF)
+    closeFile(outputF, forceFlush=outputFile != '-')
+  return stats
+
 # Directory API
 
 def ASPsDelete(gapiDirObj, userKey, codeId):
@@ -2185,6 +3006,87 @@ def _getTopLevelOrgId(cd, customerId, parentOrgUnitPath):
     return (str(e), False)
   return (temp_org['parentOrgUnitId'], True)
 
+# Directory maps are made when their make flag is set, after directory_cache_ttl seconds
+# or when they were made for another domain/customer
+def _getDirectoryMapKey(customer):
+  return f'{GC.Values[GC.DOMAIN]}/{GC.Values[GC.CUSTOMER_ID]}/{customer}'
+
+def _isMapCurrent(makeFlag, customer):
+  expiration = GM.Globals[GM.MAP_EXPIRATIONS].get(makeFlag)
+  return (not GM.Globals[makeFlag] and expiration is not None and
+          expiration[0] == _getDirectoryMapKey(customer) and expiration[1] > time.time())
+
+def _setMapCurrent(makeFlag, customer, expires=None):
+  GM.Globals[makeFlag] = False
+  GM.Globals[GM.MAP_EXPIRATIONS][makeFlag] = (_getDirectoryMapKey(customer),
+                                              expires or time.time()+GC.Values[GC.DIRECTORY_CACHE_TTL])
+
+# Make the OrgUnit ID/Path maps with one list of all OrgUnits; returns None or an error message
+def makeOrgUnitIdPathMap(gapiDirObj, customerId):
+  if _isMapCurrent(GM.MAKE_ORGUNIT_ID_PATH_MAP, customerId):
+    return None
+  cd = useGAPIObject(gapiDirObj)
+  try:
+    orgs = callGAPIpages(cd.orgunits(), 'list', 'organizationUnits',
+                         throwReasons=[GAPI.ORGUNIT_NOT_FOUND, GAPI.INVALID_PARAMETER,
+                                       GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
+                         customerId=customerId, type='allIncludingParent',
+                         fields='organizationUnits(orgUnitId,orgUnitPath,parentOrgUnitId,parentOrgUnitPath)')
+  except (GAPI.orgunitNotFound, GAPI.invalidParameter,
+          GAPI.badRequest, GAPI.invalidCustomerId, GAPI.loginRequired) as e:
+    return str(e)
+  idToPath = {org['orgUnitId']: org['orgUnitPath'] for org in orgs}
+  if '/' not in idToPath.values():
+# The top level OrgUnit is the parent of its children; a temporary OrgUnit is only used when there are none
+    topLevelOrgIds = {org['parentOrgUnitId'] for org in orgs if org.get('parentOrgUnitPath') == '/' and 'parentOrgUnitId' in org}
+    if topLevelOrgIds:
+      idToPath[topLevelOrgIds.pop()] = '/'
+    else:
+      topLevelOrgId, status = _getTopLevelOrgId(cd, customerId, '/')
+      if not status:
+        return topLevelOrgId
+      idToPath[topLevelOrgId] = '/'
+  childIds = {}
+  for org in orgs:
+    if org.get('parentOrgUnitId'):
+      childIds.setdefault(org['parentOrgUnitId'], []).append(org['orgUnitId'])
+  GM.Globals[GM.MAP_ORGUNIT_ID_TO_NAME] = idToPath
+  GM.Globals[GM.MAP_ORGUNIT_PATH_TO_ID] = {orgUnitPath.lower(): orgUnitId for orgUnitId, orgUnitPath in idToPath.items()}
+  GM.Globals[GM.MAP_ORGUNIT_ID_TO_CHILD_IDS] = childIds
+  _setMapCurrent(GM.MAKE_ORGUNIT_ID_PATH_MAP, customerId)
+  return None
+
+def getTopLevelOrgId(gapiDirObj, customerId):
+  return convertOrgUnitPathToID(gapiDirObj, customerId, '/')
+
+# Returns an OrgUnit ID/Path or None if the OrgUnit does not exist or the map can't be made
+def convertOrgUnitIDtoPath(gapiDirObj, customerId, orgUnitId):
+  if makeOrgUnitIdPathMap(gapiDirObj, customerId) is not None:
+    return None
+  if not orgUnitId.startswith('id:'):
+    orgUnitId = f'id:{orgUnitId}'
+  return GM.Globals[GM.MAP_ORGUNIT_ID_TO_NAME].get(orgUnitId)
+
+def convertOrgUnitPathToID(gapiDirObj, customerId, orgUnitPath):
+  if makeOrgUnitIdPathMap(gapiDirObj, customerId) is not None:
+    return None
+  orgUnitPath = makeOrgUnitPathAbsolute(orgUnitPath)
+  if orgUnitPath.startswith('id:'):
+    return orgUnitPath if orgUnitPath in GM.Globals[GM.MAP_ORGUNIT_ID_TO_NAME] else None
+  return GM.Globals[GM.MAP_ORGUNIT_PATH_TO_ID].get(orgUnitPath.lower())
+
+# Returns the paths of an OrgUnit and its sub OrgUnits, parents before children, or None
+def getOrgUnitSubtree(gapiDirObj, customerId, orgUnitPath, includeParent=True):
+  orgUnitId = convertOrgUnitPathToID(gapiDirObj, customerId, orgUnitPath)
+  if orgUnitId is None:
+    return None
+  idToPath = GM.Globals[GM.MAP_ORGUNIT_ID_TO_NAME]
+  childIds = GM.Globals[GM.MAP_ORGUNIT_ID_TO_CHILD_IDS]
+  orgUnitIds = [orgUnitId]
+  for orgUnitId in orgUnitIds:
+    orgUnitIds.extend(childIds.get(orgUnitId, []))
+  return [idToPath[orgUnitId] for orgUnitId in orgUnitIds[0 if includeParent else 1:]]
+
 def OrgunitsDelete(gapiDirObj, customerId, orgUnitPath):
   cd = useGAPIObject(gapiDirObj)
   try:
@@ -2192,6 +3094,7 @@ def OrgunitsDelete(gapiDirObj, customerId, orgUnitPath):
              throwReasons=[GAPI.CONDITION_NOT_MET, GAPI.INVALID_ORGUNIT, GAPI.ORGUNIT_NOT_FOUND, GAPI.BACKEND_ERROR,
                            GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
              customerId=customerId, orgUnitPath=encodeOrgUnitPath(makeOrgUnitPathRelative(orgUnitPath)))
+    GM.Globals[GM.MAKE_ORGUNIT_ID_PATH_MAP] = True
     return {}
   except (GAPI.conditionNotMet, GAPI.invalidOrgunit, GAPI.orgunitNotFound, GAPI.backendError,
           GAPI.badRequest, GAPI.invalidCustomerId, GAPI.loginRequired) as e:
@@ -2201,17 +3104,10 @@ def OrgunitsGet(gapiDirObj, customerId, orgUnitPath, **kwargs):
   cd = useGAPIObject(gapiDirObj)
   try:
     if orgUnitPath == '/':
-      orgs = callGAPI(cd.orgunits(), 'list',
-                      throwReasons=[GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
-                      customerId=customerId, type='children',
-                      fields='organizationUnits(parentOrgUnitId)')
-      if orgs.get('organizationUnits', []):
-        orgUnitPath = orgs['organizationUnits'][0]['parentOrgUnitId']
-      else:
-        topLevelOrgId, status = _getTopLevelOrgId(cd, customerId, '/')
-        if not status:
-          return (topLevelOrgId, status)
-        orgUnitPath = topLevelOrgId
+      status = makeOrgUnitIdPathMap(gapiDirObj, customerId)
+      if status is not None:
+        return status
+      orgUnitPath = GM.Globals[GM.MAP_ORGUNIT_PATH_TO_ID]['/']
     else:
       orgUnitPath = makeOrgUnitPathRelative(orgUnitPath)
     result = callGAPI(cd.orgunits(), 'get',
@@ -2233,6 +3129,7 @@ def OrgunitsInsert(gapiDirObj, customerId, **kwargs):
                                     GAPI.BACKEND_ERROR, GAPI.INVALID_PARAMETER,
                                     GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
                       customerId=customerId, **kwargs)
+    GM.Globals[GM.MAKE_ORGUNIT_ID_PATH_MAP] = True
     return cleanJSON(result)
   except (GAPI.invalidParentOrgunit, GAPI.invalidOrgunit, GAPI.invalidOrgunitName,
           GAPI.backendError, GAPI.invalidParameter,
@@ -2260,6 +3157,7 @@ def OrgunitsUpdate(gapiDirObj, customerId, orgUnitPath, **kwargs):
                                     GAPI.BACKEND_ERROR, GAPI.INVALID_PARAMETER,
                                     GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
                       customerId=customerId, orgUnitPath=encodeOrgUnitPath(makeOrgUnitPathRelative(orgUnitPath)), **kwargs)
+    GM.Globals[GM.MAKE_ORGUNIT_ID_PATH_MAP] = True
     return cleanJSON(result)
   except (GAPI.invalidOrgunit, GAPI.orgunitNotFound, GAPI.invalidOrgunitName,
           GAPI.backendError, GAPI.invalidParameter,
@@ -2277,17 +3175,118 @@ def PrivilegesList(gapiDirObj, customer, **kwargs):
   except (GAPI.invalidParameter, GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden) as e:
     return str(e)
 
+# Building and Calendar Resource catalogue; made with one list of each and kept in memory and in
+# resourcecatalogue.json in the gam.cfg directory until directory_cache_ttl seconds have passed
+# or a Building/Calendar Resource is changed with a wrapper
+def _getResourceCatalogueFile():
+  return os.path.join(GM.Globals[GM.GAM_CFG_PATH] or GM.Globals[GM.GAM_PATH], FN_RESOURCE_CATALOGUE_JSON)
+
+def _readResourceCatalogues():
+  try:
+    with open(_getResourceCatalogueFile(), DEFAULT_FILE_READ_MODE, encoding=UTF8) as f:
+      catalogues = json.load(f)
+    return catalogues if isinstance(catalogues, dict) else {}
+  except (IOError, ValueError):
+    return {}
+
+def _setResourceCatalogue(customer, catalogue):
+  buildings = catalogue['buildings']
+  calendars = catalogue['calendars']
+  GM.Globals[GM.MAP_BUILDINGS] = {building['buildingId']: building for building in buildings}
+  GM.Globals[GM.MAP_BUILDING_ID_TO_NAME] = {building['buildingId']: building.get('buildingName', '') for building in buildings}
+  GM.Globals[GM.MAP_BUILDING_NAME_TO_ID] = {building.get('buildingName', '').lower(): building['buildingId'] for building in buildings}
+  GM.Globals[GM.MAP_CALENDAR_RESOURCES] = {calendar['resourceId']: calendar for calendar in calendars}
+  GM.Globals[GM.MAP_CALENDAR_RESOURCE_EMAIL_TO_ID] = {calendar.get('resourceEmail', '').lower(): calendar['resourceId'] for calendar in calendars}
+  _setMapCurrent(GM.MAKE_BUILDING_ID_NAME_MAP, customer, catalogue['expires'])
+
+# Discard the catalogue after a Building/Calendar Resource is changed
+def clearResourceCatalogue(customer):
+  GM.Globals[GM.MAKE_BUILDING_ID_NAME_MAP] = True
+  catalogues = _readResourceCatalogues()
+  if catalogues.pop(_getDirectoryMapKey(customer), None) is not None:
+    writeJSONFileAtomic(_getResourceCatalogueFile(), catalogues)
+
+# Make the Building/Calendar Resource maps from resourcecatalogue.json or the API; returns None or an error message
+def makeBuildingIdNameMap(gapiDirObj, customer, refresh=False):
+  if not refresh and _isMapCurrent(GM.MAKE_BUILDING_ID_NAME_MAP, customer):
+    return None
+  catalogueKey = _getDirectoryMapKey(customer)
+  catalogues = _readResourceCatalogues()
+  catalogue = catalogues.get(catalogueKey)
+  if not refresh and isinstance(catalogue, dict) and catalogue.get('expires', 0) > time.time():
+    _setResourceCatalogue(customer, catalogue)
+    return None
+  cd = useGAPIObject(gapiDirObj)
+  try:
+    buildings = callGAPIpages(cd.resources().buildings(), 'list', 'buildings',
+                              throwReasons=[GAPI.INVALID_PARAMETER,
+                                            GAPI.BAD_REQUEST, GAPI.NOT_FOUND, GAPI.FORBIDDEN],
+                              customer=customer, maxResults=500)
+    calendars = callGAPIpages(cd.resources().calendars(), 'list', 'items',
+                              throwReasons=[GAPI.INVALID_INPUT, GAPI.INVALID_PARAMETER,
+                                            GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.FORBIDDEN],
+                              customer=customer, maxResults=500)
+  except (GAPI.invalidInput, GAPI.invalidParameter,
+          GAPI.badRequest, GAPI.notFound, GAPI.resourceNotFound, GAPI.forbidden) as e:
+    return str(e)
+  catalogue = {'expires': time.time()+GC.Values[GC.DIRECTORY_CACHE_TTL],
+               'buildings': cleanJSON(buildings), 'calendars': cleanJSON(calendars)}
+  _setResourceCatalogue(customer, catalogue)
+# Expired catalogues of other domains/customers are dropped
+  catalogues = {key: value for key, value in catalogues.items() if isinstance(value, dict) and value.get('expires', 0) > time.time()}
+  catalogues[catalogueKey] = catalogue
+  writeJSONFileAtomic(_getResourceCatalogueFile(), catalogues)
+  return None
+
+# Return a Building name/ID or Calendar Resource ID or None if it does not exist or the catalogue can't be made
+def convertBuildingIDtoName(gapiDirObj, customer, buildingId):
+  if makeBuildingIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  return GM.Globals[GM.MAP_BUILDING_ID_TO_NAME].get(buildingId)
+
+def convertBuildingNameToID(gapiDirObj, customer, buildingName):
+  if makeBuildingIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  return GM.Globals[GM.MAP_BUILDING_NAME_TO_ID].get(buildingName.lower())
+
+def convertCalendarResourceEmailToID(gapiDirObj, customer, resourceEmail):
+  if makeBuildingIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  return GM.Globals[GM.MAP_CALENDAR_RESOURCE_EMAIL_TO_ID].get(resourceEmail.lower())
+
+# Return a copy of a cached Building/Calendar Resource or None
+def _getCachedBuilding(gapiDirObj, customer, buildingId):
+  if makeBuildingIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  building = GM.Globals[GM.MAP_BUILDINGS].get(buildingId)
+  if building is None:
+    building = GM.Globals[GM.MAP_BUILDINGS].get(GM.Globals[GM.MAP_BUILDING_NAME_TO_ID].get(buildingId.lower()))
+  return copy.deepcopy(building)
+
+def _getCachedCalendarResource(gapiDirObj, customer, calendarResourceId):
+  if makeBuildingIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  calendar = GM.Globals[GM.MAP_CALENDAR_RESOURCES].get(calendarResourceId)
+  if calendar is None:
+    calendar = GM.Globals[GM.MAP_CALENDAR_RESOURCES].get(GM.Globals[GM.MAP_CALENDAR_RESOURCE_EMAIL_TO_ID].get(calendarResourceId.lower()))
+  return copy.deepcopy(calendar)
+
 def ResourcesBuildingsDelete(gapiDirObj, customer, buildingId):
   cd = useGAPIObject(gapiDirObj)
   try:
     callGAPI(cd.resources().buildings(), 'delete',
              throwReasons=[GAPI.RESOURCE_NOT_FOUND, GAPI.BAD_REQUEST, GAPI.NOT_FOUND, GAPI.FORBIDDEN],
              customer=customer, buildingId=buildingId)
+    clearResourceCatalogue(customer)
     return {}
   except (GAPI.resourceNotFound, GAPI.badRequest, GAPI.notFound, GAPI.forbidden) as e:
     return str(e)
 
-def ResourcesBuildingsGet(gapiDirObj, customer, buildingId, **kwargs):
+def ResourcesBuildingsGet(gapiDirObj, customer, buildingId, cached=False, **kwargs):
+  if cached:
+    building = _getCachedBuilding(gapiDirObj, customer, buildingId)
+    if building is not None:
+      return building
   cd = useGAPIObject(gapiDirObj)
   try:
     result = callGAPI(cd.resources().buildings(), 'get',
@@ -2306,16 +3305,20 @@ def ResourcesBuildingsInsert(gapiDirObj, customer, **kwargs):
                       throwReasons=[GAPI.DUPLICATE, GAPI.INVALID_INPUT, GAPI.INVALID_PARAMETER,
                                     GAPI.BAD_REQUEST, GAPI.NOT_FOUND, GAPI.FORBIDDEN],
                       customer=customer, **kwargs)
+    clearResourceCatalogue(customer)
     return cleanJSON(result)
   except (GAPI.duplicate, GAPI.invalidInput, GAPI.invalidParameter,
           GAPI.badRequest, GAPI.notFound, GAPI.forbidden) as e:
     return str(e)
 
-def ResourcesBuildingsList(gapiDirObj, customer, **kwargs):
+def ResourcesBuildingsList(gapiDirObj, customer, cached=False, **kwargs):
+  if cached and not kwargs:
+    if makeBuildingIdNameMap(gapiDirObj, customer) is None:
+      return copy.deepcopy(list(GM.Globals[GM.MAP_BUILDINGS].values()))
   cd = useGAPIObject(gapiDirObj)
-  fields = f"nextPageToken,items({kwargs.pop('fields', 'resourceId,resourceName,resourceEmail,resourceDescription,resourceType')})"
+  fields = f"nextPageToken,buildings({kwargs.pop('fields', 'buildingId,buildingName')})"
   try:
-    result = callGAPIpages(cd.resources().buildings(), 'list', 'items',
+    result = callGAPIpages(cd.resources().buildings(), 'list', 'buildings',
                            throwReasons=[GAPI.INVALID_PARAMETER,
                                          GAPI.BAD_REQUEST, GAPI.NOT_FOUND, GAPI.FORBIDDEN],
                            customer=customer, fields=fields, **kwargs)
@@ -2331,6 +3334,7 @@ def ResourcesBuildingsPatch(gapiDirObj, customer, buildingId, **kwargs):
                       throwReasons=[GAPI.DUPLICATE, GAPI.RESOURCE_NOT_FOUND, GAPI.INVALID_INPUT, GAPI.INVALID_PARAMETER,
                                     GAPI.BAD_REQUEST, GAPI.NOT_FOUND, GAPI.FORBIDDEN],
                       customer=customer, buildingId=buildingId, **kwargs)
+    clearResourceCatalogue(customer)
     return cleanJSON(result)
   except (GAPI.duplicate, GAPI.resourceNotFound, GAPI.invalidInput, GAPI.invalidParameter,
           GAPI.badRequest, GAPI.notFound, GAPI.forbidden) as e:
@@ -2342,11 +3346,16 @@ def ResourcesCalendarsDelete(gapiDirObj, customer, calendarResourceId):
     callGAPI(cd.resources().calendars(), 'delete',
              throwReasons=[GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.FORBIDDEN],
              customer=customer, calendarResourceId=calendarResourceId)
+    clearResourceCatalogue(customer)
     return {}
   except (GAPI.badRequest, GAPI.resourceNotFound, GAPI.forbidden) as e:
     return str(e)
 
-def ResourcesCalendarsGet(gapiDirObj, customer, calendarResourceId, **kwargs):
+def ResourcesCalendarsGet(gapiDirObj, customer, calendarResourceId, cached=False, **kwargs):
+  if cached:
+    calendar = _getCachedCalendarResource(gapiDirObj, customer, calendarResourceId)
+    if calendar is not None:
+      return calendar
   cd = useGAPIObject(gapiDirObj)
   try:
     result = callGAPI(cd.resources().calendars(), 'get',
@@ -2363,12 +3372,16 @@ def ResourcesCalendarsInsert(gapiDirObj, customer, **kwargs):
                       throwReasons=[GAPI.INVALID, GAPI.INVALID_INPUT, GAPI.REQUIRED, GAPI.INVALID_PARAMETER, GAPI.DUPLICATE,
                                     GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.FORBIDDEN],
                       customer=customer, **kwargs)
+    clearResourceCatalogue(customer)
     return cleanJSON(result)
   except (GAPI.invalid, GAPI.invalidInput, GAPI.required, GAPI.invalidParameter, GAPI.duplicate,
           GAPI.badRequest, GAPI.resourceNotFound, GAPI.forbidden) as e:
     return str(e)
 
-def ResourcesCalendarsList(gapiDirObj, customer, **kwargs):
+def ResourcesCalendarsList(gapiDirObj, customer, cached=False, **kwargs):
+  if cached and not kwargs:
+    if makeBuildingIdNameMap(gapiDirObj, customer) is None:
+      return copy.deepcopy(list(GM.Globals[GM.MAP_CALENDAR_RESOURCES].values()))
   cd = useGAPIObject(gapiDirObj)
   fields = f"nextPageToken,items({kwargs.pop('fields', 'resourceId,resourceName,resourceEmail,resourceDescription,resourceType')})"
   try:
@@ -2388,6 +3401,7 @@ def ResourcesCalendarsPatch(gapiDirObj, customer, calendarResourceId, **kwargs):
                       throwReasons=[GAPI.INVALID, GAPI.INVALID_INPUT, GAPI.REQUIRED, GAPI.INVALID_PARAMETER,
                                     GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.FORBIDDEN],
                       customer=customer, calendarResourceId=calendarResourceId, **kwargs)
+    clearResourceCatalogue(customer)
     return cleanJSON(result)
   except (GAPI.invalid, GAPI.invalidInput, GAPI.required, GAPI.invalidParameter,
           GAPI.badRequest, GAPI.resourceNotFound, GAPI.forbidden) as e:
@@ -2464,13 +3478,29 @@ def RoleAssignmentsDelete(gapiDirObj, customer, roleAssignmentId):
           GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden) as e:
     return str(e)
 
-def RoleAssignmentsGet(gapiDirObj, customer, roleAssignmentId):
+# Add roleName and, for OrgUnit scoped assignments, orgUnitPath from the cached maps
+def _annotateRoleAssignments(gapiDirObj, customer, assignments):
+  if makeRoleIdNameMap(gapiDirObj, customer) is None:
+    roleIdToName = GM.Globals[GM.MAP_ROLE_ID_TO_NAME]
+    for assignment in assignments:
+      if 'roleId' in assignment:
+        assignment['roleName'] = roleIdToName.get(str(assignment['roleId']), '')
+  if any('orgUnitId' in assignment for assignment in assignments):
+    if makeOrgUnitIdPathMap(gapiDirObj, customer) is None:
+      for assignment in assignments:
+        if 'orgUnitId' in assignment:
+          assignment['orgUnitPath'] = convertOrgUnitIDtoPath(gapiDirObj, customer, assignment['orgUnitId']) or ''
+  return assignments
+
+def RoleAssignmentsGet(gapiDirObj, customer, roleAssignmentId, annotate=True):
   cd = useGAPIObject(gapiDirObj)
   try:
     result = callGAPI(cd.roleAssignments(), 'get',
                       throwReasons=[GAPI.NOT_FOUND, GAPI.OPERATION_NOT_SUPPORTED,
                                     GAPI.BAD_REQUEST, GAPI.CUSTOMER_NOT_FOUND, GAPI.FORBIDDEN],
                       customer=customer, roleAssignmentId=roleAssignmentId)
+    if annotate:
+      _annotateRoleAssignments(gapiDirObj, customer, [result])
     return cleanJSON(result)
   except (GAPI.notFound, GAPI.operationNotSupported,
           GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden) as e:
@@ -2488,7 +3518,7 @@ def RoleAssignmentsInsert(gapiDirObj, customer, **kwargs):
           GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden, GAPI.internalError) as e:
     return str(e)
 
-def RoleAssignmentsList(gapiDirObj, customer, userKey, **kwargs):
+def RoleAssignmentsList(gapiDirObj, customer, userKey, annotate=True, **kwargs):
   cd = useGAPIObject(gapiDirObj)
   fields = f"nextPageToken,items({kwargs.pop('fields', 'roleAssignmentId,roleId,assignedTo,scopeType,orgUnitId')})"
   try:
@@ -2496,6 +3526,8 @@ def RoleAssignmentsList(gapiDirObj, customer, userKey, **kwargs):
                            throwReasons=[GAPI.INVALID, GAPI.INVALID_PARAMETER,
                                          GAPI.BAD_REQUEST, GAPI.CUSTOMER_NOT_FOUND, GAPI.FORBIDDEN],
                            customer=customer, userKey=userKey, fields=fields)
+    if annotate:
+      _annotateRoleAssignments(gapiDirObj, customer, result)
     return cleanJSON(result)
   except (GAPI.invalid, GAPI.invalidParameter,
           GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden) as e:
@@ -2512,6 +3544,59 @@ def RolesList(gapiDirObj, customer, **kwargs):
   except (GAPI.invalidParameter, GAPI.badRequest, GAPI.customerNotFound, GAPI.forbidden) as e:
     return str(e)
 
+# Make the Role ID/Name/Privileges maps with one list of all Roles; returns None or an error message
+def makeRoleIdNameMap(gapiDirObj, customer):
+  if _isMapCurrent(GM.MAKE_ROLE_ID_NAME_MAP, customer):
+    return None
+  roles = RolesList(gapiDirObj, customer, fields='roleId,roleName,rolePrivileges')
+  if isinstance(roles, str):
+    return roles
+  GM.Globals[GM.MAP_ROLE_ID_TO_NAME] = {str(role['roleId']): role['roleName'] for role in roles}
+  GM.Globals[GM.MAP_ROLE_NAME_TO_ID] = {role['roleName'].lower(): str(role['roleId']) for role in roles}
+  GM.Globals[GM.MAP_ROLE_ID_TO_PRIVILEGES] = {str(role['roleId']): role.get('rolePrivileges', []) for role in roles}
+  _setMapCurrent(GM.MAKE_ROLE_ID_NAME_MAP, customer)
+  return None
+
+# Make the Privilege map, child privileges are included; returns None or an error message
+def makePrivilegeMap(gapiDirObj, customer):
+  def _addPrivileges(privileges):
+    for privilege in privileges:
+      privilegeMap[(privilege['serviceId'], privilege['privilegeName'])] = {k: v for k, v in privilege.items() if k != 'childPrivileges'}
+      _addPrivileges(privilege.get('childPrivileges', []))
+
+  if _isMapCurrent(GM.MAKE_PRIVILEGE_MAP, customer):
+    return None
+  privileges = PrivilegesList(gapiDirObj, customer, fields='serviceId,serviceName,privilegeName,isOuScopable,childPrivileges')
+  if isinstance(privileges, str):
+    return privileges
+  privilegeMap = {}
+  _addPrivileges(privileges)
+  GM.Globals[GM.MAP_PRIVILEGES] = privilegeMap
+  _setMapCurrent(GM.MAKE_PRIVILEGE_MAP, customer)
+  return None
+
+# Return a Role name/ID or None if the Role does not exist or the map can't be made
+def convertRoleIDtoName(gapiDirObj, customer, roleId):
+  if makeRoleIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  return GM.Globals[GM.MAP_ROLE_ID_TO_NAME].get(str(roleId))
+
+def convertRoleNameToID(gapiDirObj, customer, roleName):
+  if makeRoleIdNameMap(gapiDirObj, customer) is not None:
+    return None
+  return GM.Globals[GM.MAP_ROLE_NAME_TO_ID].get(roleName.lower())
+
+# Returns the privileges of a Role, by name or ID, with serviceName and isOuScopable or None
+def getRolePrivileges(gapiDirObj, customer, roleKey):
+  roleId = convertRoleNameToID(gapiDirObj, customer, roleKey)
+  if roleId is None:
+    roleId = str(roleKey)
+  rolePrivileges = GM.Globals[GM.MAP_ROLE_ID_TO_PRIVILEGES].get(roleId)
+  if rolePrivileges is None:
+    return None
+  privilegeMap = GM.Globals[GM.MAP_PRIVILEGES] if makePrivilegeMap(gapiDirObj, customer) is None else {}
+  return [dict(privilegeMap.get((privilege['serviceId'], privilege['privilegeName']), privilege)) for privilege in rolePrivileges]
+
 def SchemasDelete(gapiDirObj, customerId, schemaKey):
   cd = useGAPIObject(gapiDirObj)
   try:
@@ -2600,6 +3685,103 @@ def TokensList(gapiDirObj, userKey, **kwargs):
           GAPI.domainNotFound, GAPI.domainCannotUseApis, GAPI.notFound, GAPI.forbidden) as e:
     return str(e)
 
+# User ID to primary email map; it holds at most USER_ID_MAP_MAX_SIZE entries, the least recently used are evicted.
+# Unknown user IDs are resolved with batched requests in parallel; when there are at least USER_ID_MAP_SWEEP_MIN
+# of them, all users are listed first as that takes far fewer API calls.
+# User IDs that are not found are remembered with an empty email. The email to ID map is used to drop deleted/updated users
+USER_ID_MAP_MAX_SIZE = 500000
+USER_ID_MAP_SWEEP_MIN = 5000
+USER_ID_NOT_FOUND_REASONS = {GAPI.USER_NOT_FOUND, GAPI.RESOURCE_NOT_FOUND, GAPI.NOT_FOUND}
+
+def _dropUserIdEmail(userId):
+  email = GM.Globals[GM.MAP_USER_ID_TO_NAME].pop(userId, None)
+  if email and GM.Globals[GM.MAP_USER_EMAIL_TO_ID].get(email.lower()) == userId:
+    del GM.Globals[GM.MAP_USER_EMAIL_TO_ID][email.lower()]
+
+def _setUserIdEmail(userId, email):
+  userIdMap = GM.Globals[GM.MAP_USER_ID_TO_NAME]
+  _dropUserIdEmail(userId)
+  userIdMap[userId] = email
+  if email:
+    GM.Globals[GM.MAP_USER_EMAIL_TO_ID][email.lower()] = userId
+  if len(userIdMap) > USER_ID_MAP_MAX_SIZE:
+    _dropUserIdEmail(next(iter(userIdMap)))
+
+# Seed the map from a UsersList result that includes the id and primaryEmail fields
+def seedUserIdEmailMap(users):
+  for user in users:
+    if user.get('id') and user.get('primaryEmail'):
+      _setUserIdEmail(user['id'], user['primaryEmail'])
+
+def clearUserIdEmailMap():
+  GM.Globals[GM.MAP_USER_ID_TO_NAME].clear()
+  GM.Globals[GM.MAP_USER_EMAIL_TO_ID].clear()
+
+# Return the user ID of userKey, an id:ID, numeric ID or primary email address in the map, else None
+def _getMappedUserId(userKey):
+  if userKey.startswith('id:'):
+    return userKey[3:]
+  if userKey.isdigit():
+    return userKey
+  return GM.Globals[GM.MAP_USER_EMAIL_TO_ID].get(userKey.lower())
+
+def _getUserIdEmails(gapiDirObj, userIds):
+  cd = useGAPIObject(gapiDirObj)
+  return callGAPIbatch(cd, [(userId, cd.users().get(userKey=userId, fields='id,primaryEmail')) for userId in userIds])
+
+# Returns {userId: primaryEmail}; the email of a user ID that can not be resolved is None.
+# With errors, a dictionary, the user IDs that failed with an error other than not found are set in it: {userId: message}
+def convertUserIDsToEmails(gapiDirObj, userIds, numThreads=None, errors=None):
+  import concurrent.futures
+
+  userIdMap = GM.Globals[GM.MAP_USER_ID_TO_NAME]
+  emails = {}
+  unknownIds = []
+  for userId in userIds:
+    if userId in emails:
+      continue
+    email = userIdMap.pop(userId, None)
+    if email is not None:
+      userIdMap[userId] = email
+      emails[userId] = email or None
+    else:
+      emails[userId] = None
+      unknownIds.append(userId)
+  if len(unknownIds) >= USER_ID_MAP_SWEEP_MIN:
+    users = UsersList(gapiDirObj, customer=GC.Values[GC.CUSTOMER_ID], maxResults=500, fields='id,primaryEmail')
+    if not isinstance(users, str):
+      seedUserIdEmailMap(users)
+      for user in users:
+        if user.get('id') in emails and user.get('primaryEmail'):
+          emails[user['id']] = user['primaryEmail']
+      unknownIds = [userId for userId in unknownIds if emails[userId] is None]
+  if not unknownIds:
+    return emails
+  session = getCurrentSession()
+  pool = GAPIObjectPool(gapiDirObj)
+  batchSize = GC.Values[GC.BATCH_SIZE]
+  chunks = [unknownIds[i:i+batchSize] for i in range(0, len(unknownIds), batchSize)]
+  with concurrent.futures.ThreadPoolExecutor(max_workers=min(numThreads or GC.Values[GC.NUM_THREADS], len(chunks))) as executor:
+    futures = [submitInSession(executor, session, callWithPooledGAPIObject, pool, gapiDirObj, _getUserIdEmails, chunk) for chunk in chunks]
+    for chunk, future in zip(chunks, futures):
+      result = future.result()
+      if isinstance(result, str):
+        results, chunkErrors = {}, {userId: (0, None, result) for userId in chunk}
+      else:
+        results, chunkErrors = result
+      for userId, result in results.items():
+        emails[userId] = result.get('primaryEmail')
+        _setUserIdEmail(userId, emails[userId] or '')
+      for userId, (_, reason, message) in chunkErrors.items():
+        if reason in USER_ID_NOT_FOUND_REASONS:
+          _setUserIdEmail(userId, '')
+        elif errors is not None:
+          errors[userId] = message
+  return emails
+
+def convertUserIDtoEmail(gapiDirObj, userId):
+  return convertUserIDsToEmails(gapiDirObj, [userId])[userId]
+
 def UsersDelete(gapiDirObj, userKey):
   cd = useGAPIObject(gapiDirObj)
   try:
@@ -2607,6 +3789,7 @@ def UsersDelete(gapiDirObj, userKey):
              throwReasons=[GAPI.USER_NOT_FOUND,
                            GAPI.DOMAIN_NOT_FOUND, GAPI.DOMAIN_CANNOT_USE_APIS, GAPI.FORBIDDEN],
              userKey=userKey)
+    _dropUserIdEmail(_getMappedUserId(userKey))
     return {}
   except (GAPI.userNotFound,
           GAPI.domainNotFound, GAPI.domainCannotUseApis, GAPI.forbidden) as e:
@@ -2677,6 +3860,7 @@ def UsersUpdate(gapiDirObj, userKey, **kwargs):
                                     GAPI.INVALID, GAPI.INVALID_INPUT, GAPI.INVALID_PARAMETER,
                                     GAPI.INVALID_ORGUNIT, GAPI.INVALID_SCHEMA_VALUE],
                       userKey=userKey, **kwargs)
+    _dropUserIdEmail(result.get('id') or _getMappedUserId(userKey))
     return cleanJSON(result, skipObjects=USER_SKIP_OBJECTS, timeObjects=USER_TIME_OBJECTS)
   except (GAPI.userNotFound, GAPI.domainNotFound, GAPI.domainCannotUseApis, GAPI.forbidden,
           GAPI.invalid, GAPI.invalidInput, GAPI.invalidParameter,
@@ -2755,6 +3939,615 @@ def VerificationCodesList(gapiDirObj, userKey, **kwargs):
   except (GAPI.userNotFound, GAPI.invalidParameter) as e:
     return str(e)
 
+# Directory snapshot; a SQLite copy of the users, groups, group members, org units and ChromeOS devices of a customer
+# so that lookups by email, alias, id and org unit path and queries are local.
+# The Directory API has no updated since queries for these objects; refresh() lists just the ids and etags
+# and gets only the new/changed users and groups, groups whose etag has changed have their members relisted
+DIRECTORY_SNAPSHOT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, email TEXT, orgUnitPath TEXT COLLATE NOCASE, etag TEXT, json TEXT);
+CREATE INDEX IF NOT EXISTS usersEmail ON users (email);
+CREATE INDEX IF NOT EXISTS usersOrgUnitPath ON users (orgUnitPath);
+CREATE TABLE IF NOT EXISTS groups (id TEXT PRIMARY KEY, email TEXT, etag TEXT, json TEXT);
+CREATE INDEX IF NOT EXISTS groupsEmail ON groups (email);
+CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, kind TEXT, id TEXT);
+CREATE INDEX IF NOT EXISTS aliasesId ON aliases (id);
+CREATE TABLE IF NOT EXISTS orgunits (orgUnitId TEXT PRIMARY KEY, orgUnitPath TEXT COLLATE NOCASE, parentOrgUnitPath TEXT COLLATE NOCASE, json TEXT);
+CREATE INDEX IF NOT EXISTS orgunitsOrgUnitPath ON orgunits (orgUnitPath);
+CREATE INDEX IF NOT EXISTS orgunitsParentOrgUnitPath ON orgunits (parentOrgUnitPath);
+CREATE TABLE IF NOT EXISTS members (groupId TEXT, id TEXT, email TEXT, role TEXT, type TEXT, json TEXT, PRIMARY KEY (groupId, id));
+CREATE INDEX IF NOT EXISTS membersId ON members (id);
+CREATE INDEX IF NOT EXISTS membersEmail ON members (email);
+CREATE TABLE IF NOT EXISTS chromeosdevices (id TEXT PRIMARY KEY, json TEXT);
+'''
+DIRECTORY_SNAPSHOT_ALIAS_FIELDS = ['aliases', 'nonEditableAliases']
+# maxResults for users, groups and members; a full list is used rather than individual gets
+# when more objects have changed than there are pages in the list
+DIRECTORY_SNAPSHOT_PAGE_SIZES = {'users': 500, 'groups': 200, 'members': 200, 'chromeosdevices': 200}
+
+class DirectorySnapshot():
+  def __init__(self, gapiDirObj, dbFile, customerId=None):
+    import sqlite3
+
+    self.gapiDirObj = gapiDirObj
+    self.customerId = customerId or GC.Values[GC.CUSTOMER_ID]
+    self.db = sqlite3.connect(os.path.expanduser(dbFile))
+    self.db.executescript(DIRECTORY_SNAPSHOT_SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    self.db.close()
+
+  def _setAliases(self, kind, obj):
+    self.db.execute('DELETE FROM aliases WHERE id = ?', (obj['id'],))
+    self.db.executemany('INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)',
+                        [(alias.lower(), kind, obj['id']) for field in DIRECTORY_SNAPSHOT_ALIAS_FIELDS for alias in obj.get(field, [])])
+
+  def _putUser(self, user):
+    self.db.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)',
+                    (user['id'], user.get('primaryEmail', '').lower(), user.get('orgUnitPath', ''), user.get('etag'), json.dumps(user)))
+    self._setAliases('user', user)
+
+  def _putGroup(self, group):
+    self.db.execute('INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?)',
+                    (group['id'], group.get('email', '').lower(), group.get('etag'), json.dumps(group)))
+    self._setAliases('group', group)
+
+  def _deleteObjects(self, table, ids):
+    for objId in ids:
+      self.db.execute(f'DELETE FROM {table} WHERE id = ?', (objId,))
+      self.db.execute('DELETE FROM aliases WHERE id = ?', (objId,))
+      if table == 'groups':
+        self.db.execute('DELETE FROM members WHERE groupId = ?', (objId,))
+
+  def _getEtags(self, table):
+    return dict(self.db.execute(f'SELECT id, etag FROM {table}'))
+
+# Refresh a table of users or groups; returns the ids of new/changed objects
+  def _refreshObjects(self, cd, table, full):
+    if table == 'users':
+      service, putObject = cd.users(), self._putUser
+    else:
+      service, putObject = cd.groups(), self._putGroup
+    throwReasons = [GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.INVALID_INPUT,
+                    GAPI.DOMAIN_NOT_FOUND, GAPI.DOMAIN_CANNOT_USE_APIS, GAPI.FORBIDDEN]
+    pageSize = DIRECTORY_SNAPSHOT_PAGE_SIZES[table]
+    oldEtags = self._getEtags(table)
+    if not full:
+      newEtags = {obj['id']: obj.get('etag') for obj in callGAPIpages(service, 'list', table,
+                                                                        throwReasons=throwReasons,
+                                                                        customer=self.customerId, maxResults=pageSize,
+                                                                        fields=f'nextPageToken,{table}(id,etag)')}
+      changedIds = [objId for objId, etag in newEtags.items() if oldEtags.get(objId) != etag]
+      if len(changedIds) <= len(newEtags)//pageSize+1:
+        for objId in changedIds:
+          try:
+            if table == 'users':
+              obj = callGAPI(service, 'get',
+                             throwReasons=GAPI.USER_GET_THROW_REASONS,
+                             userKey=objId)
+            else:
+              obj = callGAPI(service, 'get',
+                             throwReasons=GAPI.GROUP_GET_THROW_REASONS,
+                             retryReasons=GAPI.GROUP_GET_RETRY_REASONS,
+                             groupKey=objId)
+            putObject(obj)
+          except (GAPI.userNotFound, GAPI.groupNotFound):
+            newEtags.pop(objId)
+        self._deleteObjects(table, set(oldEtags)-set(newEtags))
+        return [objId for objId in changedIds if objId in newEtags]
+    objs = callGAPIpages(service, 'list', table,
+                         throwReasons=throwReasons,
+                         customer=self.customerId, maxResults=pageSize)
+    for obj in objs:
+      putObject(obj)
+    self._deleteObjects(table, set(oldEtags)-{obj['id'] for obj in objs})
+    return [obj['id'] for obj in objs if oldEtags.get(obj['id']) != obj.get('etag')]
+
+  def _refreshOrgunits(self, cd):
+    orgs = callGAPIpages(cd.orgunits(), 'list', 'organizationUnits',
+                         throwReasons=[GAPI.ORGUNIT_NOT_FOUND, GAPI.BAD_REQUEST, GAPI.INVALID_CUSTOMER_ID, GAPI.LOGIN_REQUIRED],
+                         customerId=self.customerId, type='all')
+    self.db.execute('DELETE FROM orgunits')
+    self.db.executemany('INSERT OR REPLACE INTO orgunits VALUES (?, ?, ?, ?)',
+                        [(org['orgUnitId'], org['orgUnitPath'], org.get('parentOrgUnitPath', ''), json.dumps(org)) for org in orgs])
+
+  def _refreshMembers(self, cd, groupIds):
+    for groupId in groupIds:
+      try:
+        members = callGAPIpages(cd.members(), 'list', 'members',
+                                throwReasons=GAPI.MEMBERS_THROW_REASONS,
+                                retryReasons=GAPI.MEMBERS_RETRY_REASONS,
+                                groupKey=groupId, maxResults=DIRECTORY_SNAPSHOT_PAGE_SIZES['members'])
+      except GAPI.groupNotFound:
+        members = []
+      self.db.execute('DELETE FROM members WHERE groupId = ?', (groupId,))
+      self.db.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?)',
+                          [(groupId, member.get('id', member.get('email', '')), member.get('email', '').lower(),
+                            member.get('role', ''), member.get('type', ''), json.dumps(member)) for member in members])
+
+  def _refreshChromeosdevices(self, cd):
+    devices = callGAPIpages(cd.chromeosdevices(), 'list', 'chromeosdevices',
+                            throwReasons=[GAPI.INVALID_INPUT, GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.FORBIDDEN],
+                            customerId=self.customerId, maxResults=DIRECTORY_SNAPSHOT_PAGE_SIZES['chromeosdevices'])
+    self.db.execute('DELETE FROM chromeosdevices')
+    self.db.executemany('INSERT OR REPLACE INTO chromeosdevices VALUES (?, ?)',
+                        [(device['deviceId'], json.dumps(device)) for device in devices])
+    return len(devices)
+
+# Refresh the snapshot; full=True relists everything, otherwise only the changes are fetched.
+# Returns the number of new/changed users and groups, the number of groups whose members were listed
+# and, with devices=True, the number of ChromeOS devices which are always relisted
+  def refresh(self, full=False, members=True, devices=False):
+    cd = useGAPIObject(self.gapiDirObj)
+    try:
+      with self.db:
+        full = full or self.getRefreshTime() is None
+        changedUsers = self._refreshObjects(cd, 'users', full)
+        changedGroups = self._refreshObjects(cd, 'groups', full)
+        self._refreshOrgunits(cd)
+        memberGroups = []
+        if members:
+          memberGroups = [groupId for (groupId,) in self.db.execute('SELECT id FROM groups')] if full else changedGroups
+          self._refreshMembers(cd, memberGroups)
+        numDevices = self._refreshChromeosdevices(cd) if devices else 0
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        ('refreshTime', ISOformatTimeStamp(datetime.datetime.now(datetime.timezone.utc))))
+      self.db.execute('PRAGMA optimize')
+      return {'users': len(changedUsers), 'groups': len(changedGroups), 'members': len(memberGroups), 'chromeosdevices': numDevices}
+    except (GAPI.badRequest, GAPI.resourceNotFound, GAPI.invalidInput, GAPI.orgunitNotFound, GAPI.invalidCustomerId,
+            GAPI.loginRequired, GAPI.userNotFound, GAPI.groupNotFound, GAPI.domainNotFound, GAPI.domainCannotUseApis,
+            GAPI.forbidden, GAPI.invalid, GAPI.systemError) as e:
+      return str(e)
+
+  def getRefreshTime(self):
+    row = self.db.execute("SELECT value FROM meta WHERE name = 'refreshTime'").fetchone()
+    return row[0] if row else None
+
+  def _getId(self, table, key):
+    if '@' not in key:
+      row = self.db.execute(f'SELECT id FROM {table} WHERE id = ?', (key,)).fetchone()
+      return row[0] if row else None
+    key = key.lower()
+    row = self.db.execute(f'SELECT id FROM {table} WHERE email = ?', (key,)).fetchone()
+    if row:
+      return row[0]
+    row = self.db.execute('SELECT id FROM aliases WHERE alias = ? AND kind = ?', (key, table[:-1])).fetchone()
+    return row[0] if row else None
+
+  def _getObject(self, table, key, skipObjects=None, timeObjects=None):
+    row = self.db.execute(f'SELECT json FROM {table} WHERE id = ?', (self._getId(table, key),)).fetchone()
+    return cleanJSON(json.loads(row[0]), skipObjects=skipObjects, timeObjects=timeObjects) if row else None
+
+# Returns a user/group by primary email, alias or id or None
+  def getUser(self, userKey):
+    return self._getObject('users', userKey, skipObjects=USER_SKIP_OBJECTS, timeObjects=USER_TIME_OBJECTS)
+
+  def getGroup(self, groupKey):
+    return self._getObject('groups', groupKey)
+
+# Returns an org unit by path or id:<orgUnitId> or None
+  def getOrgunit(self, orgUnitPath):
+    orgUnitPath = makeOrgUnitPathAbsolute(orgUnitPath)
+    if orgUnitPath.startswith('id:'):
+      row = self.db.execute('SELECT json FROM orgunits WHERE orgUnitId = ?', (orgUnitPath,)).fetchone()
+    else:
+      row = self.db.execute('SELECT json FROM orgunits WHERE orgUnitPath = ?', (orgUnitPath,)).fetchone()
+    return cleanJSON(json.loads(row[0])) if row else None
+
+# Returns the users in an org unit, optionally including its sub org units
+  def getOrgunitUsers(self, orgUnitPath, includeChildren=False):
+    orgUnitPath = makeOrgUnitPathAbsolute(orgUnitPath)
+    if not includeChildren:
+      rows = self.db.execute('SELECT json FROM users WHERE orgUnitPath = ?', (orgUnitPath,))
+    elif orgUnitPath == '/':
+      rows = self.db.execute('SELECT json FROM users')
+    else:
+      rows = self.db.execute("SELECT json FROM users WHERE orgUnitPath = ? OR orgUnitPath LIKE ? ESCAPE '\\'",
+                             (orgUnitPath, orgUnitPath.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')+'/%'))
+    return cleanJSON([json.loads(row[0]) for row in rows], skipObjects=USER_SKIP_OBJECTS, timeObjects=USER_TIME_OBJECTS)
+
+# Returns the direct members of a group or None if the group is not in the snapshot
+  def getMembers(self, groupKey):
+    groupId = self._getId('groups', groupKey)
+    if groupId is None:
+      return None
+    return cleanJSON([json.loads(row[0]) for row in self.db.execute('SELECT json FROM members WHERE groupId = ?', (groupId,))])
+
+# Returns the groups of which a user/group is a direct member
+  def getMemberships(self, memberKey):
+    memberId = self._getId('users', memberKey) or self._getId('groups', memberKey)
+    if memberId is None:
+      rows = self.db.execute('SELECT groupId FROM members WHERE email = ?', (memberKey.lower(),))
+    else:
+      rows = self.db.execute('SELECT groupId FROM members WHERE id = ?', (memberId,))
+    return [self.getGroup(groupId) for (groupId,) in rows.fetchall()]
+
+# Index a field used in queries
+  def createIndex(self, table, field):
+    try:
+      fieldExpr = _makeSnapshotFieldExpr(table, field)
+    except ValueError as e:
+      return str(e)
+    with self.db:
+      self.db.execute(f'CREATE INDEX IF NOT EXISTS "{table}:{field}" ON {table} ({fieldExpr})')
+      self.db.execute(f'ANALYZE {table}')
+    return {}
+
+# Generator of the objects in table that match a filter, see makeSnapshotQuery
+  def query(self, table, query='', fields=None, orderBy=None):
+    try:
+      where, params = makeSnapshotQuery(table, query)
+      sql = f'SELECT json FROM {table}'+(f' WHERE {where}' if where else '')
+      if orderBy:
+        field, _, direction = orderBy.partition(' ')
+        direction = direction.strip().upper() or 'ASC'
+        if direction not in {'ASC', 'DESC'}:
+          raise ValueError(f'{Msg.INVALID} orderBy: {orderBy}')
+        sql += f' ORDER BY {_makeSnapshotFieldExpr(table, field)} {direction}'
+      cursor = self.db.execute(sql, params)
+    except ValueError as e:
+      return str(e)
+    return self._yieldQuery(table, cursor, fields)
+
+  def _yieldQuery(self, table, cursor, fields):
+    skipObjects, timeObjects = DIRECTORY_SNAPSHOT_CLEAN_OBJECTS.get(table, (None, None))
+    for (objJSON,) in cursor:
+      obj = json.loads(objJSON)
+      if fields:
+        obj = {field: obj[field] for field in fields if field in obj}
+      yield cleanJSON(obj, skipObjects=skipObjects, timeObjects=timeObjects)
+
+  def count(self, table, query=''):
+    try:
+      where, params = makeSnapshotQuery(table, query)
+    except ValueError as e:
+      return str(e)
+    return self.db.execute(f'SELECT COUNT(*) FROM {table}'+(f' WHERE {where}' if where else ''), params).fetchone()[0]
+
+# Snapshot queries, e.g. suspended=false AND orgUnitPath startswith /Staff AND lastLoginTime < 90d
+# <Condition> [AND|OR <Condition>]..., NOT and parentheses are allowed; AND binds tighter than OR
+# <Condition> ::= <Field> =|!=|<|<=|>|>=|startswith|endswith|contains <Value>
+# <Field> is a field name, name.fullName selects a sub-field
+# <Value> is true, false, null, a number, <Number>m|h|d|w (that long before now), a word or a quoted string
+DIRECTORY_SNAPSHOT_TABLES = {'users', 'groups', 'orgunits', 'members', 'chromeosdevices'}
+# files is the DriveFileIndex table
+SNAPSHOT_QUERY_TABLES = DIRECTORY_SNAPSHOT_TABLES.union({'files'})
+DIRECTORY_SNAPSHOT_CLEAN_OBJECTS = {'users': (USER_SKIP_OBJECTS, USER_TIME_OBJECTS), 'chromeosdevices': (None, CROS_TIME_OBJECTS)}
+SNAPSHOT_QUERY_TOKEN_PATTERN = re.compile(r"""\s*(?:([()])|(<=|>=|!=|=|<|>)|"((?:[^"\\]|\\.)*)"|'((?:[^'\\]|\\.)*)'|([^\s()<>=!"']+))""")
+SNAPSHOT_QUERY_FIELD_PATTERN = re.compile(r'^[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*$')
+SNAPSHOT_QUERY_DELTA_PATTERN = re.compile(r'^(\d+)([mhdw])$')
+SNAPSHOT_QUERY_DELTA_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+SNAPSHOT_QUERY_OPERATORS = {'startswith', 'endswith', 'contains'}
+
+def _makeSnapshotFieldExpr(table, field):
+  if table not in SNAPSHOT_QUERY_TABLES:
+    raise ValueError(f'{Msg.INVALID} table: {table}')
+  if not SNAPSHOT_QUERY_FIELD_PATTERN.match(field):
+    raise ValueError(f'{Msg.INVALID} field: {field}')
+  return f"json_extract(json, '$.{field}')"
+
+def _getSnapshotQueryValue(kind, value):
+  if kind != 'word':
+    return re.sub(r'\\(.)', r'\1', value)
+  lvalue = value.lower()
+  if lvalue in TRUE_FALSE:
+    return int(lvalue == TRUE)
+  if lvalue == 'null':
+    return None
+  mg = SNAPSHOT_QUERY_DELTA_PATTERN.match(lvalue)
+  if mg:
+    delta = datetime.timedelta(**{SNAPSHOT_QUERY_DELTA_UNITS[mg.group(2)]: int(mg.group(1))})
+    return (datetime.datetime.now(datetime.timezone.utc)-delta).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+  try:
+    return int(value)
+  except ValueError:
+    pass
+  try:
+    return float(value)
+  except ValueError:
+    return value
+
+# Returns (where, params) for a snapshot query; raises ValueError
+def makeSnapshotQuery(table, query):
+  tokens = []
+  pos = 0
+  query = query.strip()
+  while pos < len(query):
+    mg = SNAPSHOT_QUERY_TOKEN_PATTERN.match(query, pos)
+    if not mg or mg.end() == pos:
+      raise ValueError(f'{Msg.INVALID} query at: {query[pos:]}')
+    pos = mg.end()
+    if mg.group(1):
+      tokens.append(('paren', mg.group(1)))
+    elif mg.group(2):
+      tokens.append(('op', mg.group(2)))
+    elif mg.group(3) is not None:
+      tokens.append(('string', mg.group(3)))
+    elif mg.group(4) is not None:
+      tokens.append(('string', mg.group(4)))
+    else:
+      word = mg.group(5)
+      lword = word.lower()
+      if lword in {'and', 'or', 'not'}:
+        tokens.append((lword, word))
+      elif lword in SNAPSHOT_QUERY_OPERATORS:
+        tokens.append(('op', lword))
+      else:
+        tokens.append(('word', word))
+  params = []
+  i = 0
+
+  def _peek():
+    return tokens[i][0] if i < len(tokens) else None
+
+  def _next(expected):
+    nonlocal i
+    if i >= len(tokens):
+      raise ValueError(f'{Msg.INVALID} query, {Msg.EXPECTED}: {expected}')
+    token = tokens[i]
+    i += 1
+    return token
+
+  def _condition():
+    kind, field = _next('field')
+    if kind != 'word':
+      raise ValueError(f'{Msg.INVALID} field: {field}')
+    fieldExpr = _makeSnapshotFieldExpr(table, field)
+    kind, op = _next('operator')
+    if kind != 'op':
+      raise ValueError(f'{Msg.INVALID} operator: {op}')
+    kind, value = _next('value')
+    if kind not in {'word', 'string'}:
+      raise ValueError(f'{Msg.INVALID} value: {value}')
+    value = _getSnapshotQueryValue(kind, value)
+    if value is None:
+      if op not in {'=', '!='}:
+        raise ValueError(f'{Msg.INVALID} operator for null: {op}')
+      return f'{fieldExpr} IS {"NOT " if op == "!=" else ""}NULL'
+    if op == 'startswith':
+      value = str(value)
+      params.extend([value, value+'\U0010ffff'])
+      return f'({fieldExpr} >= ? AND {fieldExpr} < ?)'
+    if op == 'endswith':
+      value = str(value)
+      if not value:
+        return f'{fieldExpr} IS NOT NULL'
+      params.extend([len(value), value])
+      return f'substr({fieldExpr}, -?) = ?'
+    if op == 'contains':
+      params.append(str(value))
+      return f'instr({fieldExpr}, ?) > 0'
+    params.append(value)
+    if op == '!=':
+      return f'{fieldExpr} IS NOT ?'
+    return f'{fieldExpr} {op} ?'
+
+  def _factor():
+    nonlocal i
+    kind = _peek()
+    if kind == 'not':
+      i += 1
+      return f'NOT {_factor()}'
+    if kind == 'paren' and tokens[i][1] == '(':
+      i += 1
+      expr = _expr()
+      kind, value = _next(')')
+      if value != ')':
+        raise ValueError(f'{Msg.INVALID} query, {Msg.EXPECTED}: )')
+      return f'({expr})'
+    return _condition()
+
+  def _term():
+    nonlocal i
+    factors = [_factor()]
+    while _peek() == 'and':
+      i += 1
+      factors.append(_factor())
+    return ' AND '.join(factors)
+
+  def _expr():
+    nonlocal i
+    terms = [_term()]
+    while _peek() == 'or':
+      i += 1
+      terms.append(_term())
+    return ' OR '.join(f'({term})' for term in terms) if len(terms) > 1 else terms[0]
+
+  if not tokens:
+    return ('', [])
+  where = _expr()
+  if i < len(tokens):
+    raise ValueError(f'{Msg.INVALID} query at: {tokens[i][1]}')
+  return (where, params)
+
+# Group membership graph; the direct members of each group are listed once and kept,
+# subgroups are listed in parallel a level at a time and nested memberships are resolved locally.
+# Groups are keyed by lowercase email
+MEMBERSHIP_GRAPH_FIELDS = 'email,id,role,type,status'
+
+class GroupMembershipGraph():
+  def __init__(self, gapiDirObj, numThreads=None):
+    self.gapiDirObj = gapiDirObj
+    self.numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+    self.members = {}
+    self.errors = {}
+    self.etags = {}
+    self.effective = {}
+    self.parents = None
+
+# List the members of groups and, transitively, of their subgroups that have not been listed
+  def expand(self, groupKeys):
+    import concurrent.futures
+
+    session = getCurrentSession()
+    pool = GAPIObjectPool(self.gapiDirObj)
+    pending = {groupKey.lower() for groupKey in groupKeys}-set(self.members)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.numThreads) as executor:
+      while pending:
+        futures = {groupEmail: submitInSession(executor, session, callWithPooledGAPIObject, pool, self.gapiDirObj,
+                                               MembersList, groupEmail, fields=MEMBERSHIP_GRAPH_FIELDS)
+                   for groupEmail in pending}
+        pending = set()
+        for groupEmail, future in futures.items():
+          result = future.result()
+          if isinstance(result, str):
+            self.errors[groupEmail] = result
+            result = []
+          else:
+            self.errors.pop(groupEmail, None)
+          self.members[groupEmail] = result
+          for member in result:
+            if member.get('type') == 'GROUP':
+              subgroupEmail = member.get('email', '').lower()
+              if subgroupEmail and subgroupEmail not in self.members and subgroupEmail not in futures:
+                pending.add(subgroupEmail)
+          self.parents = None
+
+# Drop the cached effective members of the groups and of the groups whose nested members include them
+  def _invalidate(self, groupEmails):
+    if groupEmails:
+      self.effective = {groupEmail: effective for groupEmail, effective in self.effective.items()
+                        if groupEmail not in groupEmails and groupEmails.isdisjoint(effective)}
+      self.parents = None
+
+# List all of the groups and their members; the group etags are kept for refresh
+  def expandAll(self):
+    cd = useGAPIObject(self.gapiDirObj)
+    try:
+      groups = callGAPIpages(cd.groups(), 'list', 'groups',
+                             throwReasons=[GAPI.BAD_REQUEST, GAPI.RESOURCE_NOT_FOUND, GAPI.INVALID_INPUT,
+                                           GAPI.DOMAIN_NOT_FOUND, GAPI.DOMAIN_CANNOT_USE_APIS, GAPI.FORBIDDEN],
+                             customer=GC.Values[GC.CUSTOMER_ID], maxResults=200, fields='nextPageToken,groups(email,etag)')
+    except (GAPI.badRequest, GAPI.resourceNotFound, GAPI.invalidInput,
+            GAPI.domainNotFound, GAPI.domainCannotUseApis, GAPI.forbidden) as e:
+      return str(e)
+    etags = {group['email'].lower(): group.get('etag') for group in groups}
+    changed = [groupEmail for groupEmail, etag in etags.items() if self.etags.get(groupEmail) != etag]
+    deleted = {groupEmail for groupEmail in set(self.members)-set(etags) if groupEmail in self.etags}
+    for groupEmail in deleted:
+      self.members.pop(groupEmail)
+    for groupEmail in changed:
+      self.members.pop(groupEmail, None)
+    self.etags = etags
+    self._invalidate(deleted.union(changed))
+    self.expand(etags)
+    return {'groups': len(etags), 'changed': len(changed)}
+
+# Relist the members of groups; with no groupKeys, the groups whose etags have changed since expandAll
+  def refresh(self, groupKeys=None):
+    if groupKeys is None:
+      return self.expandAll()
+    for groupKey in groupKeys:
+      self.members.pop(groupKey.lower(), None)
+    self._invalidate({groupKey.lower() for groupKey in groupKeys})
+    self.expand(groupKeys)
+    return {'groups': len(groupKeys), 'changed': len(groupKeys)}
+
+  def getDirectMembers(self, groupKey):
+    groupEmail = groupKey.lower()
+    if groupEmail not in self.members:
+      self.expand([groupEmail])
+    return self.members[groupEmail]
+
+# Returns {email: member} of the members of a group and its nested subgroups; a member reached through
+# several paths is returned once with the first membership found. Subgroups are included with includeGroups
+  def getEffectiveMembers(self, groupKey, includeGroups=False):
+    groupEmail = groupKey.lower()
+    if groupEmail not in self.effective:
+      self.expand([groupEmail])
+      effective = {}
+      visited = {groupEmail}
+      stack = [groupEmail]
+      while stack:
+        for member in self.members.get(stack.pop(), []):
+          memberEmail = member.get('email', member.get('id', '')).lower()
+          if member.get('type') == 'GROUP':
+            if memberEmail in visited:
+              continue
+            visited.add(memberEmail)
+            if memberEmail in self.effective:
+              for email, subMember in self.effective[memberEmail].items():
+                effective.setdefault(email, subMember)
+                if subMember.get('type') == 'GROUP':
+                  visited.add(email)
+            else:
+              stack.append(memberEmail)
+          effective.setdefault(memberEmail, member)
+      effective.pop(groupEmail, None)
+      self.effective[groupEmail] = effective
+    if includeGroups:
+      return dict(self.effective[groupEmail])
+    return {email: member for email, member in self.effective[groupEmail].items() if member.get('type') != 'GROUP'}
+
+  def isMember(self, memberKey, groupKey):
+    return memberKey.lower() in self.getEffectiveMembers(groupKey, includeGroups=True)
+
+# Returns the emails of the listed groups of which memberKey is a direct or nested member
+  def getEffectiveMemberships(self, memberKey):
+    if self.parents is None:
+      self.parents = {}
+      for groupEmail, members in self.members.items():
+        for member in members:
+          self.parents.setdefault(member.get('email', member.get('id', '')).lower(), []).append(groupEmail)
+    parents = self.parents
+    memberships = set()
+    stack = [memberKey.lower()]
+    while stack:
+      for groupEmail in parents.get(stack.pop(), []):
+        if groupEmail not in memberships:
+          memberships.add(groupEmail)
+          stack.append(groupEmail)
+    memberships.discard(memberKey.lower())
+    return sorted(memberships)
+
+# Returns the cycles, lists of group emails that are nested in each other, among the listed groups
+  def getCycles(self):
+    index = {}
+    lowlink = {}
+    onStack = set()
+    stack = []
+    cycles = []
+    for root in self.members:
+      if root in index:
+        continue
+      work = [(root, 0)]
+      while work:
+        groupEmail, i = work.pop()
+        if i == 0:
+          index[groupEmail] = lowlink[groupEmail] = len(index)
+          stack.append(groupEmail)
+          onStack.add(groupEmail)
+        subgroups = [member.get('email', '').lower() for member in self.members.get(groupEmail, []) if member.get('type') == 'GROUP']
+        if i > 0:
+          lowlink[groupEmail] = min(lowlink[groupEmail], lowlink[subgroups[i-1]])
+        while i < len(subgroups):
+          subgroup = subgroups[i]
+          i += 1
+          if subgroup not in index:
+            work.append((groupEmail, i))
+            work.append((subgroup, 0))
+            break
+          if subgroup in onStack:
+            lowlink[groupEmail] = min(lowlink[groupEmail], index[subgroup])
+        else:
+          if lowlink[groupEmail] == index[groupEmail]:
+            component = []
+            while True:
+              member = stack.pop()
+              onStack.discard(member)
+              component.append(member)
+              if member == groupEmail:
+                break
+            if len(component) > 1 or groupEmail in subgroups:
+              cycles.append(sorted(component))
+    return cycles
+
 # Drive v3 API
 
 def DriveAbout(gapiDriveObj, **kwargs):
@@ -2769,15 +4562,21 @@ def DriveAbout(gapiDriveObj, **kwargs):
 
 DRIVE_FILES_TIME_OBJECTS = set(['createdTime,viewedByMeTime,modifiedByMeTime,modifiedTime,sharedWithMeTime'])
 
-def DriveFilesCreate(gapiDriveObj, **kwargs):
+def DriveFilesCreate(gapiDriveObj, mediaFile=None, mimeType=None, chunkSize=None, **kwargs):
   drive = useGAPIServiceObject(gapiDriveObj)
-  try:
-    result = callGAPI(drive.files(), 'create',
-                      throwReasons=GAPI.DRIVE_USER_THROW_REASONS+[GAPI.FORBIDDEN, GAPI.INSUFFICIENT_PERMISSIONS,
-                                                                  GAPI.INVALID, GAPI.BAD_REQUEST, GAPI.CANNOT_ADD_PARENT,
-                                                                  GAPI.FILE_NOT_FOUND, GAPI.UNKNOWN_ERROR, GAPI.INVALID_PARAMETER,
-                                                                  GAPI.TEAMDRIVES_SHARING_RESTRICTION_NOT_ALLOWED],
-                      **kwargs)
+  throwReasons = GAPI.DRIVE_USER_THROW_REASONS+[GAPI.FORBIDDEN, GAPI.INSUFFICIENT_PERMISSIONS,
+                                                GAPI.INVALID, GAPI.BAD_REQUEST, GAPI.CANNOT_ADD_PARENT,
+                                                GAPI.FILE_NOT_FOUND, GAPI.UNKNOWN_ERROR, GAPI.INVALID_PARAMETER,
+                                                GAPI.TEAMDRIVES_SHARING_RESTRICTION_NOT_ALLOWED]
+  try:
+    if mediaFile:
+      result = callGAPIupload(drive.files(), 'create', mediaFile, mimeType,
+                              chunkSize=chunkSize, throwReasons=throwReasons,
+                              **kwargs)
+    else:
+      result = callGAPI(drive.files(), 'create',
+                        throwReasons=throwReasons,
+                        **kwargs)
     return cleanJSON(result, timeObjects=DRIVE_FILES_TIME_OBJECTS)
   except (GAPI.forbidden, GAPI.insufficientFilePermissions,
           GAPI.invalid, GAPI.badRequest, GAPI.cannotAddParent,
@@ -2835,6 +4634,125 @@ def DriveFilesGet(gapiDriveObj, fileId, **kwargs):
           GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
     return str(e)
 
+# Drive file download; the file is downloaded in ranges of chunkSize (default download_chunk_size) MB,
+# numThreads ranges at a time, to <outputFile>.part. <outputFile>.part.ranges records the file, the chunk size and the
+# starts of the completed ranges; a resumed download with the same chunk size fetches only the missing ranges. The file is renamed to outputFile when its md5Checksum has been verified.
+# Google Docs files have no content, they are exported with mimeType in one request
+DRIVE_DOWNLOAD_THROW_REASONS = GAPI.DRIVE_GET_THROW_REASONS+[GAPI.FORBIDDEN, GAPI.INSUFFICIENT_FILE_PERMISSIONS,
+                                                             GAPI.INVALID_PARAMETER, GAPI.BAD_REQUEST]
+
+def _getDriveFileRange(gapiDriveObj, fileId, start, end):
+  drive = useGAPIServiceObject(gapiDriveObj)
+  try:
+    return callGAPI(drive.files(), 'get_media',
+                    throwReasons=DRIVE_DOWNLOAD_THROW_REASONS, requestHeaders={'range': f'bytes={start}-{end}'},
+                    fileId=fileId, supportsAllDrives=True)
+  except (GAPI.fileNotFound, GAPI.forbidden, GAPI.insufficientFilePermissions,
+          GAPI.invalidParameter, GAPI.badRequest,
+          GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
+    return str(e)
+
+# Returns the completed ranges recorded for a download of the file described by header
+def _readDriveDownloadRanges(partFile, rangesFile, header):
+  ranges = set()
+  if not os.path.isfile(partFile):
+    return ranges
+  f = openFile(rangesFile, encoding=UTF8, continueOnError=True, displayError=False)
+  if f:
+    for lineNum, line in enumerate(f):
+      try:
+        record = json.loads(line) if line.endswith('\n') else None
+      except ValueError:
+        record = None
+      if record is None or (lineNum == 0 and record != header):
+        break
+      if lineNum > 0:
+        ranges.add(record)
+    closeFile(f)
+  return ranges
+
+def _getFileMD5(fileName):
+  md5 = hashlib.md5()
+  with open(fileName, 'rb') as f:
+    for data in iter(lambda: f.read(1024*1024), b''):
+      md5.update(data)
+  return md5.hexdigest()
+
+# Returns {'name': <String>, 'size': <Number>, 'md5Checksum': <String>} or an error message
+def DriveFilesDownload(gapiDriveObj, fileId, outputFile, mimeType=None,
+                       numThreads=None, chunkSize=None, resume=True):
+  import concurrent.futures
+
+  drive = useGAPIServiceObject(gapiDriveObj)
+  outputFile = os.path.expanduser(outputFile)
+  try:
+    if mimeType:
+      data = callGAPI(drive.files(), 'export_media',
+                      throwReasons=DRIVE_DOWNLOAD_THROW_REASONS,
+                      fileId=fileId, mimeType=mimeType)
+      with open(outputFile, 'wb') as f:
+        f.write(data)
+      return {'size': len(data)}
+    metadata = callGAPI(drive.files(), 'get',
+                        throwReasons=DRIVE_DOWNLOAD_THROW_REASONS,
+                        fileId=fileId, fields='name,size,md5Checksum', supportsAllDrives=True)
+  except (GAPI.fileNotFound, GAPI.forbidden, GAPI.insufficientFilePermissions,
+          GAPI.invalidParameter, GAPI.badRequest,
+          GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
+    return str(e)
+  if 'size' not in metadata:
+    return f'{metadata.get("name", fileId)}: mimeType is required to export a Google Docs file'
+  size = int(metadata['size'])
+  chunkSize = (chunkSize or GC.Values[GC.DOWNLOAD_CHUNK_SIZE])*1024*1024
+  numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+  partFile = f'{outputFile}.part'
+  rangesFile = f'{partFile}.ranges'
+  header = {'fileId': fileId, 'size': size, 'md5Checksum': metadata.get('md5Checksum'), 'chunkSize': chunkSize}
+  completed = _readDriveDownloadRanges(partFile, rangesFile, header) if resume else set()
+  if completed:
+    rf = openFile(rangesFile, DEFAULT_FILE_APPEND_MODE, encoding=UTF8)
+  else:
+    with open(partFile, 'wb') as f:
+      f.truncate(size)
+    rf = openFile(rangesFile, DEFAULT_FILE_WRITE_MODE, encoding=UTF8)
+    rf.write(json.dumps(header)+'\n')
+    rf.flush()
+  pending = collections.deque(start for start in range(0, size, chunkSize) if start not in completed)
+  session = getCurrentSession()
+  pool = GAPIObjectPool(gapiDriveObj)
+  error = None
+  with open(partFile, 'r+b') as f, concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+    futures = {}
+    while pending or futures:
+      while pending and not error and len(futures) < numThreads:
+        start = pending.popleft()
+        end = min(start+chunkSize, size)-1
+        futures[submitInSession(executor, session, callWithPooledGAPIObject, pool, gapiDriveObj,
+                                _getDriveFileRange, fileId, start, end)] = start
+      if not futures:
+        break
+      done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        start = futures.pop(future)
+        data = future.result()
+        if isinstance(data, str):
+          error = error or data
+          continue
+        os.pwrite(f.fileno(), data, start)
+        os.fsync(f.fileno())
+        rf.write(f'{start}\n')
+        rf.flush()
+  closeFile(rf)
+  if error:
+    return error
+  if header['md5Checksum'] and _getFileMD5(partFile) != header['md5Checksum']:
+    os.remove(partFile)
+    os.remove(rangesFile)
+    return f'{Msg.INVALID} md5Checksum: {metadata.get("name", fileId)}'
+  os.replace(partFile, outputFile)
+  os.remove(rangesFile)
+  return {'name': metadata.get('name'), 'size': size, 'md5Checksum': header['md5Checksum']}
+
 def DriveFilesList(gapiDriveObj, **kwargs):
   drive = useGAPIServiceObject(gapiDriveObj)
   fields = f"nextPageToken,files({kwargs.pop('fields', 'id')})"
@@ -2851,6 +4769,64 @@ def DriveFilesList(gapiDriveObj, **kwargs):
           GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
     return str(e)
 
+# Drive tree walk; folders are listed breadth first, numThreads at a time, with pooled gapiObjs.
+# A file with several parents in the tree is returned once, with the first path found
+DRIVE_WALK_FIELDS = ['id', 'name', 'mimeType']
+DRIVE_WALK_THROW_REASONS = GAPI.DRIVE_USER_THROW_REASONS+[GAPI.INVALID_QUERY, GAPI.INVALID, GAPI.FILE_NOT_FOUND,
+                                                          GAPI.INVALID_PARAMETER,
+                                                          GAPI.NOT_FOUND, GAPI.TEAMDRIVE_MEMBERSHIP_REQUIRED]
+
+def _listDriveFolderChildren(gapiDriveObj, folderId, fields, kwargs):
+  drive = useGAPIServiceObject(gapiDriveObj)
+  try:
+    return callGAPIpages(drive.files(), 'list', 'files',
+                         throwReasons=DRIVE_WALK_THROW_REASONS,
+                         q=f"'{folderId}' in parents and trashed = false", fields=fields,
+                         pageSize=GC.Values[GC.DRIVE_MAX_RESULTS], supportsAllDrives=True, includeItemsFromAllDrives=True,
+                         **kwargs)
+  except (GAPI.invalidQuery, GAPI.invalid, GAPI.fileNotFound,
+          GAPI.invalidParameter,
+          GAPI.notFound, GAPI.teamDriveMembershipRequired,
+          GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
+    return str(e)
+
+# Generator of (path, file) of the files and folders in the tree under folderId, paths are relative to folderId.
+# fields are the file fields, id, name and mimeType are always included.
+# A folder that can not be listed yields (path, <Message>) and its subtree is skipped
+def DriveFilesWalk(gapiDriveObj, folderId='root', fields=None, numThreads=None, **kwargs):
+  import concurrent.futures
+
+  fileFields = DRIVE_WALK_FIELDS+[field for field in (fields or '').split(',') if field and field not in DRIVE_WALK_FIELDS]
+  fields = f"nextPageToken,files({','.join(fileFields)})"
+  numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+  session = getCurrentSession()
+  pool = GAPIObjectPool(gapiDriveObj)
+  visited = {folderId}
+  folders = collections.deque([(folderId, '')])
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+    futures = {}
+    while folders or futures:
+      while folders and len(futures) < numThreads:
+        parentId, parentPath = folders.popleft()
+        future = submitInSession(executor, session, callWithPooledGAPIObject, pool, gapiDriveObj,
+                                 _listDriveFolderChildren, parentId, fields, kwargs)
+        futures[future] = parentPath
+      done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        parentPath = futures.pop(future)
+        children = future.result()
+        if isinstance(children, str):
+          yield (parentPath, children)
+          continue
+        for child in cleanJSON(children, timeObjects=DRIVE_FILES_TIME_OBJECTS):
+          if child['id'] in visited:
+            continue
+          visited.add(child['id'])
+          path = f"{parentPath}/{child['name']}" if parentPath else child['name']
+          if child['mimeType'] == MIMETYPE_GA_FOLDER:
+            folders.append((child['id'], path))
+          yield (path, child)
+
 def DriveFilesUpdate(gapiDriveObj, fileId, **kwargs):
   drive = useGAPIServiceObject(gapiDriveObj)
   try:
@@ -3013,8 +4989,197 @@ def DriveRevisionsUpdate(gapiDriveObj, fileId, revisionId, **kwargs):
           GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
     return str(e)
 
+# Drive file index; a SQLite database of the files of users and shared drives kept current with the changes feed.
+# The first sync of a user/shared drive gets a start page token and then lists all of its files; later syncs apply
+# the changes since the saved page token. The page token is saved with each page of changes, so an interrupted sync
+# continues where it stopped. A page token that is no longer valid causes a full resync.
+# Files are keyed by the user's email or drive:<driveId>; trashed files are not kept.
+# The integer fields that the API returns as strings are kept as integers so that they can be compared in queries
+DRIVE_FILE_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, pageToken TEXT, syncTime TEXT);
+CREATE TABLE IF NOT EXISTS files (key TEXT, id TEXT, json TEXT, PRIMARY KEY (key, id));
+'''
+DRIVE_FILE_INDEX_FIELDS = 'id,name,mimeType,parents,size,md5Checksum,modifiedTime,trashed,owners(emailAddress),driveId'
+DRIVE_FILE_INDEX_INTEGER_FIELDS = ['size', 'quotaBytesUsed', 'version']
+DRIVE_CHANGES_PAGE_SIZE = 1000
+DRIVE_CHANGES_THROW_REASONS = GAPI.DRIVE_USER_THROW_REASONS+[GAPI.INVALID, GAPI.NOT_FOUND, GAPI.BAD_REQUEST, GAPI.FORBIDDEN,
+                                                             GAPI.INVALID_PARAMETER, GAPI.TEAMDRIVE_MEMBERSHIP_REQUIRED]
+
+class DriveFileIndex():
+  def __init__(self, dbFile):
+    import sqlite3
+
+    self.db = sqlite3.connect(os.path.expanduser(dbFile))
+    self.db.executescript(DRIVE_FILE_INDEX_SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def close(self):
+    self.db.close()
+
+  @staticmethod
+  def getKey(gapiDriveObj, driveId=None):
+    return f'drive:{driveId}' if driveId else gapiDriveObj['user'].lower()
+
+  def _putFile(self, key, driveFile):
+    for field in DRIVE_FILE_INDEX_INTEGER_FIELDS:
+      if isinstance(driveFile.get(field), str) and driveFile[field].isdigit():
+        driveFile[field] = int(driveFile[field])
+    self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (key, driveFile['id'], json.dumps(driveFile)))
+
+  def _setPageToken(self, key, pageToken):
+    self.db.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)',
+                    (key, pageToken, ISOformatTimeStamp(datetime.datetime.now(datetime.timezone.utc))))
+
+  def getPageToken(self, key):
+    row = self.db.execute('SELECT pageToken FROM tokens WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+  def getSyncTime(self, key):
+    row = self.db.execute('SELECT syncTime FROM tokens WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+  @staticmethod
+  def _getStartPageToken(drive, driveId):
+    kwargs = {'driveId': driveId, 'supportsAllDrives': True} if driveId else {}
+    return callGAPI(drive.changes(), 'getStartPageToken',
+                    throwReasons=DRIVE_CHANGES_THROW_REASONS,
+                    fields='startPageToken', **kwargs)['startPageToken']
+
+  def _listFiles(self, drive, key, driveId, fields, pageToken):
+    if driveId:
+      listKwargs = {'corpora': 'drive', 'driveId': driveId, 'includeItemsFromAllDrives': True, 'supportsAllDrives': True}
+    else:
+      listKwargs = {'corpora': 'user'}
+    files = yieldGAPIpages(drive.files(), 'list', 'files',
+                           throwReasons=DRIVE_CHANGES_THROW_REASONS,
+                           q='trashed = false', fields=f'nextPageToken,files({fields})',
+                           pageSize=GC.Values[GC.DRIVE_MAX_RESULTS], **listKwargs)
+    counts = {'full': True, 'changed': 0, 'removed': 0}
+    with self.db:
+      self.db.execute('DELETE FROM files WHERE key = ?', (key,))
+      for driveFile in files:
+        self._putFile(key, driveFile)
+        counts['changed'] += 1
+      self._setPageToken(key, pageToken)
+    return counts
+
+  def _applyChanges(self, drive, key, driveId, fields, pageToken):
+    kwargs = {'driveId': driveId, 'includeItemsFromAllDrives': True, 'supportsAllDrives': True} if driveId else {}
+    counts = {'full': False, 'changed': 0, 'removed': 0}
+    while True:
+      result = callGAPI(drive.changes(), 'list',
+                        throwReasons=DRIVE_CHANGES_THROW_REASONS,
+                        pageToken=pageToken, pageSize=DRIVE_CHANGES_PAGE_SIZE, includeRemoved=True,
+                        fields=f'nextPageToken,newStartPageToken,changes(changeType,removed,fileId,file({fields}))', **kwargs)
+      with self.db:
+        for change in result.get('changes', []):
+          if change.get('changeType', 'file') != 'file':
+            continue
+          driveFile = change.get('file')
+          if change.get('removed') or not driveFile or driveFile.get('trashed'):
+            self.db.execute('DELETE FROM files WHERE key = ? AND id = ?', (key, change['fileId']))
+            counts['removed'] += 1
+          else:
+            self._putFile(key, driveFile)
+            counts['changed'] += 1
+        pageToken = result.get('newStartPageToken') or result['nextPageToken']
+        self._setPageToken(key, pageToken)
+      if 'newStartPageToken' in result:
+        return counts
+
+# Sync the files of the user of gapiDriveObj or of a shared drive; fields are the file fields, a list or a comma separated string,
+# id and trashed are always included.
+# Returns {'full': <Boolean>, 'changed': <Number>, 'removed': <Number>} or an error message
+  def sync(self, gapiDriveObj, driveId=None, fields=None, full=False):
+    drive = useGAPIServiceObject(gapiDriveObj)
+    key = self.getKey(gapiDriveObj, driveId)
+    if isinstance(fields, list):
+      fields = ','.join(fields)
+    fields = 'id,trashed,'+(fields or DRIVE_FILE_INDEX_FIELDS)
+    pageToken = self.getPageToken(key) if not full else None
+    try:
+      return _syncFromStartToken(pageToken, (GAPI.invalid, GAPI.notFound),
+                                lambda pageToken: self._applyChanges(drive, key, driveId, fields, pageToken),
+                                lambda: self._getStartPageToken(drive, driveId),
+                                lambda pageToken: self._listFiles(drive, key, driveId, fields, pageToken))
+    except (GAPI.invalid, GAPI.notFound, GAPI.badRequest, GAPI.forbidden,
+            GAPI.invalidParameter, GAPI.teamDriveMembershipRequired,
+            GAPI.serviceNotAvailable, GAPI.authError, GAPI.domainPolicy) as e:
+      return str(e)
+
+  def remove(self, key):
+    with self.db:
+      self.db.execute('DELETE FROM files WHERE key = ?', (key,))
+      self.db.execute('DELETE FROM tokens WHERE key = ?', (key,))
+
+  def getFile(self, key, fileId):
+    row = self.db.execute('SELECT json FROM files WHERE key = ? AND id = ?', (key, fileId)).fetchone()
+    return cleanJSON(json.loads(row[0]), timeObjects=DRIVE_FILES_TIME_OBJECTS) if row else None
+
+# Index a field used in queries
+  def createIndex(self, field):
+    try:
+      fieldExpr = _makeSnapshotFieldExpr('files', field)
+    except ValueError as e:
+      return str(e)
+    with self.db:
+      self.db.execute(f'CREATE INDEX IF NOT EXISTS "files:{field}" ON files (key, {fieldExpr})')
+      self.db.execute('ANALYZE files')
+    return {}
+
+# Generator of the files of key that match a filter, see makeSnapshotQuery
+  def query(self, key, query='', fields=None, orderBy=None):
+    try:
+      where, params = makeSnapshotQuery('files', query)
+      sql = 'SELECT json FROM files WHERE key = ?'+(f' AND ({where})' if where else '')
+      if orderBy:
+        field, _, direction = orderBy.partition(' ')
+        direction = direction.strip().upper() or 'ASC'
+        if direction not in {'ASC', 'DESC'}:
+          raise ValueError(f'{Msg.INVALID} orderBy: {orderBy}')
+        sql += f" ORDER BY {_makeSnapshotFieldExpr('files', field)} {direction}"
+      cursor = self.db.execute(sql, [key]+list(params))
+    except ValueError as e:
+      return str(e)
+    return self._yieldQuery(cursor, fields)
+
+  @staticmethod
+  def _yieldQuery(cursor, fields):
+    for (fileJSON,) in cursor:
+      driveFile = json.loads(fileJSON)
+      if fields:
+        driveFile = {field: driveFile[field] for field in fields if field in driveFile}
+      yield cleanJSON(driveFile, timeObjects=DRIVE_FILES_TIME_OBJECTS)
+
+  def count(self, key, query=''):
+    try:
+      where, params = makeSnapshotQuery('files', query)
+    except ValueError as e:
+      return str(e)
+    return self.db.execute('SELECT COUNT(*) FROM files WHERE key = ?'+(f' AND ({where})' if where else ''), [key]+list(params)).fetchone()[0]
+
 # Gmail API
 
+# The Gmail List wrappers return one page of the API response; the ListAll wrappers return the items of all pages,
+# up to maxItems, and the Yield wrappers are generators that list a page at a time; fields are the item fields.
+# A Yield wrapper yields an error message as its last item if a page can not be listed
+GMAIL_LIST_PAGE_SIZE = 500
+
+def _yieldGmailItems(service, items, maxItems, **kwargs):
+  try:
+    for item in yieldGAPIpages(service, 'list', items,
+                               maxItems=maxItems,
+                               throwReasons=GAPI.GMAIL_THROW_REASONS,
+                               userId='me', **kwargs):
+      yield cleanJSON(item)
+  except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
+    yield str(e)
+
 def GmailUsersGetProfile(gapiGmailObj, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
@@ -3068,6 +5233,25 @@ def GmailDraftsList(gapiGmailObj, **kwargs):
   except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
     return str(e)
 
+def GmailDraftsListAll(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,drafts({kwargs.pop('fields', 'id,message(id,threadId)')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  try:
+    result = callGAPIpages(gmail.users().drafts(), 'list', 'drafts',
+                           maxItems=maxItems,
+                           throwReasons=GAPI.GMAIL_THROW_REASONS,
+                           userId='me', fields=fields, **kwargs)
+    return cleanJSON(result)
+  except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
+    return str(e)
+
+def GmailDraftsYield(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,drafts({kwargs.pop('fields', 'id,message(id,threadId)')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  return _yieldGmailItems(gmail.users().drafts(), 'drafts', maxItems, fields=fields, **kwargs)
+
 def GmailDraftsSend(gapiGmailObj, uploadType, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
@@ -3166,27 +5350,67 @@ def GmailLabelsUpdate(gapiGmailObj, labelId, **kwargs):
           GAPI.notFound, GAPI.invalidArgument) as e:
     return str(e)
 
-def GmailMessagesBatchDelete(gapiGmailObj, **kwargs):
-  gmail = useGAPIServiceObject(gapiGmailObj)
-  try:
-    result = callGAPI(gmail.users().messages(), 'batchDelete',
-                      throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
-                      userId='me', **kwargs)
-    return cleanJSON(result)
-  except (GAPI.serviceNotAvailable, GAPI.badRequest,
-          GAPI.invalidArgument) as e:
-    return str(e)
+# The message batchDelete/batchModify ids can be a list or iterable of any length; they are processed in chunks
+# of at most GMAIL_MESSAGES_BATCH_MAX_IDS ids, numThreads chunks at a time. A chunk that fails with a retry reason
+# is retried by callGAPI with backoff. Returns {} or an error message with the number of ids that failed;
+# with errors, a dictionary, the ids that failed are set in it: {messageId: message}
+GMAIL_MESSAGES_BATCH_MAX_IDS = 1000
+GMAIL_MESSAGES_BATCH_RETRY_REASONS = [GAPI.RATE_LIMIT_EXCEEDED, GAPI.USER_RATE_LIMIT_EXCEEDED,
+                                      GAPI.BACKEND_ERROR, GAPI.INTERNAL_ERROR, GAPI.TRANSIENT_ERROR]
 
-def GmailMessagesBatchModify(gapiGmailObj, **kwargs):
+def _callGmailMessagesBatchChunk(gapiGmailObj, function, body, kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
-    result = callGAPI(gmail.users().messages(), 'batchModify',
-                      throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
-                      userId='me', **kwargs)
-    return cleanJSON(result)
+    callGAPI(gmail.users().messages(), function,
+             throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT]+GMAIL_MESSAGES_BATCH_RETRY_REASONS,
+             retryReasons=GMAIL_MESSAGES_BATCH_RETRY_REASONS,
+             userId='me', body=body, **kwargs)
+    return None
   except (GAPI.serviceNotAvailable, GAPI.badRequest,
-          GAPI.invalidArgument) as e:
-    return str(e)
+          GAPI.invalidArgument,
+          GAPI.rateLimitExceeded, GAPI.userRateLimitExceeded,
+          GAPI.backendError, GAPI.internalError, GAPI.transientError) as e:
+    return str(e)
+
+def _callGmailMessagesBatch(gapiGmailObj, function, numThreads, errors, kwargs):
+  import concurrent.futures
+
+  body = kwargs.pop('body', {})
+  messageIds = iter(body.get('ids', []))
+  numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+  session = getCurrentSession()
+  pool = GAPIObjectPool(gapiGmailObj)
+  totalIds = 0
+  failedIds = 0
+  lastError = None
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+    window = collections.deque()
+    while True:
+      chunk = [messageId for _, messageId in zip(range(GMAIL_MESSAGES_BATCH_MAX_IDS), messageIds)]
+      if chunk:
+        totalIds += len(chunk)
+        future = submitInSession(executor, session, callWithPooledGAPIObject, pool, gapiGmailObj,
+                                 _callGmailMessagesBatchChunk, function, dict(body, ids=chunk), kwargs)
+        window.append((chunk, future))
+      while window and (not chunk or len(window) >= numThreads):
+        failedChunk, future = window.popleft()
+        result = future.result()
+        if result is not None:
+          failedIds += len(failedChunk)
+          lastError = result
+          if errors is not None:
+            errors.update((messageId, result) for messageId in failedChunk)
+      if not chunk:
+        break
+  if failedIds:
+    return f'{failedIds}/{totalIds} ids failed: {lastError}'
+  return {}
+
+def GmailMessagesBatchDelete(gapiGmailObj, numThreads=None, errors=None, **kwargs):
+  return _callGmailMessagesBatch(gapiGmailObj, 'batchDelete', numThreads, errors, kwargs)
+
+def GmailMessagesBatchModify(gapiGmailObj, numThreads=None, errors=None, **kwargs):
+  return _callGmailMessagesBatch(gapiGmailObj, 'batchModify', numThreads, errors, kwargs)
 
 def GmailMessagesDelete(gapiGmailObj, messageId):
   gmail = useGAPIServiceObject(gapiGmailObj)
@@ -3210,23 +5434,52 @@ def GmailMessagesGet(gapiGmailObj, messageId, **kwargs):
           GAPI.invalidArgument) as e:
     return str(e)
 
-def GmailMessagesImport(gapiGmailObj, uploadType, **kwargs):
+# Generator of (messageId, result) in messageIds order, result is the message or an error message.
+# The messages are fetched in batches of message_batch_size; the failed requests in a batch are retried
+def GmailMessagesGetBatch(gapiGmailObj, messageIds, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  batchSize = GC.Values[GC.MESSAGE_BATCH_SIZE]
+  messageIds = iter(messageIds)
+  while True:
+    chunk = [messageId for _, messageId in zip(range(batchSize), messageIds)]
+    if not chunk:
+      return
+    requests = [(messageId, gmail.users().messages().get(userId='me', id=messageId, **kwargs)) for messageId in chunk]
+    results, errors = callGAPIbatch(gmail, requests, batchSize=batchSize)
+    for messageId in chunk:
+      if messageId in results:
+        yield (messageId, cleanJSON(results[messageId]))
+      else:
+        http_status, reason, message = errors[messageId]
+        yield (messageId, message or formatHTTPError(http_status, reason, message))
+
+def GmailMessagesImport(gapiGmailObj, uploadType, mediaFile=None, chunkSize=None, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
-    result = callGAPI(gmail.users().messages(), 'import',
-                      throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
-                      userId='me', uploadType=uploadType, **kwargs)
+    if mediaFile:
+      result = callGAPIupload(gmail.users().messages(), 'import', mediaFile, 'message/rfc822',
+                              chunkSize=chunkSize, throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
+                              userId='me', **kwargs)
+    else:
+      result = callGAPI(gmail.users().messages(), 'import',
+                        throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
+                        userId='me', uploadType=uploadType, **kwargs)
     return cleanJSON(result)
   except (GAPI.serviceNotAvailable, GAPI.badRequest,
           GAPI.invalidArgument) as e:
     return str(e)
 
-def GmailMessagesInsert(gapiGmailObj, uploadType, **kwargs):
+def GmailMessagesInsert(gapiGmailObj, uploadType, mediaFile=None, chunkSize=None, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
-    result = callGAPI(gmail.users().messages(), 'insert',
-                      throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
-                      userId='me', uploadType=uploadType, **kwargs)
+    if mediaFile:
+      result = callGAPIupload(gmail.users().messages(), 'insert', mediaFile, 'message/rfc822',
+                              chunkSize=chunkSize, throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
+                              userId='me', **kwargs)
+    else:
+      result = callGAPI(gmail.users().messages(), 'insert',
+                        throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
+                        userId='me', uploadType=uploadType, **kwargs)
     return cleanJSON(result)
   except (GAPI.serviceNotAvailable, GAPI.badRequest,
           GAPI.invalidArgument) as e:
@@ -3242,6 +5495,25 @@ def GmailMessagesList(gapiGmailObj, **kwargs):
   except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
     return str(e)
 
+def GmailMessagesListAll(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,messages({kwargs.pop('fields', 'id,threadId')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  try:
+    result = callGAPIpages(gmail.users().messages(), 'list', 'messages',
+                           maxItems=maxItems,
+                           throwReasons=GAPI.GMAIL_THROW_REASONS,
+                           userId='me', fields=fields, **kwargs)
+    return cleanJSON(result)
+  except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
+    return str(e)
+
+def GmailMessagesYield(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,messages({kwargs.pop('fields', 'id,threadId')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  return _yieldGmailItems(gmail.users().messages(), 'messages', maxItems, fields=fields, **kwargs)
+
 def GmailMessagesModify(gapiGmailObj, messageId, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
@@ -3297,6 +5569,27 @@ def GmailMessagesAttachmentsGet(gapiGmailObj, messageId, attachmentId, **kwargs)
           GAPI.invalidArgument) as e:
     return str(e)
 
+# Download an attachment to outputFile; the base64 data is decoded and written a chunk at a time.
+# Returns {'size': <Number>} or an error message
+def GmailMessagesAttachmentsDownload(gapiGmailObj, messageId, attachmentId, outputFile):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  try:
+    result = callGAPI(gmail.users().messages().attachments(), 'get',
+                      throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.INVALID_ARGUMENT],
+                      userId='me', messageId=messageId, id=attachmentId, fields='data')
+  except (GAPI.serviceNotAvailable, GAPI.badRequest,
+          GAPI.invalidArgument) as e:
+    return str(e)
+  outputFile = os.path.expanduser(outputFile)
+  tempFileName = f'{outputFile}.tmp'
+  size = 0
+  with open(tempFileName, 'wb') as f:
+    for data in _yieldGmailRawBytes(result.pop('data', '')):
+      f.write(data)
+      size += len(data)
+  os.replace(tempFileName, outputFile)
+  return {'size': size}
+
 def GmailSettingsGetAutoForwarding(gapiGmailObj, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
@@ -3691,6 +5984,25 @@ def GmailThreadsList(gapiGmailObj, **kwargs):
   except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
     return str(e)
 
+def GmailThreadsListAll(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,threads({kwargs.pop('fields', 'id,snippet,historyId')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  try:
+    result = callGAPIpages(gmail.users().threads(), 'list', 'threads',
+                           maxItems=maxItems,
+                           throwReasons=GAPI.GMAIL_THROW_REASONS,
+                           userId='me', fields=fields, **kwargs)
+    return cleanJSON(result)
+  except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
+    return str(e)
+
+def GmailThreadsYield(gapiGmailObj, maxItems=0, **kwargs):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  fields = f"nextPageToken,threads({kwargs.pop('fields', 'id,snippet,historyId')})"
+  kwargs.setdefault('maxResults', GMAIL_LIST_PAGE_SIZE)
+  return _yieldGmailItems(gmail.users().threads(), 'threads', maxItems, fields=fields, **kwargs)
+
 def GmailThreadsModify(gapiGmailObj, threadId, **kwargs):
   gmail = useGAPIServiceObject(gapiGmailObj)
   try:
@@ -3723,3 +6035,267 @@ def GmailThreadsUntrash(gapiGmailObj, threadId, **kwargs):
   except (GAPI.serviceNotAvailable, GAPI.badRequest,
           GAPI.invalidArgument) as e:
     return str(e)
+
+# Gmail history sync; the last historyId of each mailbox is kept in a JSON state file and each sync
+# lists the history since then, coalesced per message. A mailbox with no historyId, or whose historyId
+# has expired (history list returns 404), is resynced by listing all of its message IDs
+GMAIL_HISTORY_SYNC_PAGE_SIZE = 500
+
+class GmailHistorySync():
+  def __init__(self, stateFile):
+    self.stateFile = os.path.expanduser(stateFile)
+    self.lock = threading.Lock()
+    try:
+      with open(self.stateFile, DEFAULT_FILE_READ_MODE, encoding=UTF8) as f:
+        self.state = json.load(f)
+      if not isinstance(self.state, dict):
+        self.state = {}
+    except (IOError, ValueError):
+      self.state = {}
+
+  def getHistoryId(self, mailbox):
+    return self.state.get(mailbox.lower(), {}).get('historyId')
+
+# Save the historyId of a mailbox; returns False if the state file can not be written
+  def commit(self, mailbox, historyId):
+    with self.lock:
+      self.state[mailbox.lower()] = {'historyId': historyId}
+      return writeJSONFileAtomic(self.stateFile, self.state)
+
+  def reset(self, mailbox):
+    with self.lock:
+      self.state.pop(mailbox.lower(), None)
+      return writeJSONFileAtomic(self.stateFile, self.state)
+
+  @staticmethod
+  def _applyHistory(record, added, deleted, labelChanges):
+    for item in record.get('messagesAdded', []):
+      messageId = item['message']['id']
+      added.add(messageId)
+      deleted.discard(messageId)
+      labelChanges.pop(messageId, None)
+    for item in record.get('messagesDeleted', []):
+      messageId = item['message']['id']
+      if messageId in added:
+        added.discard(messageId)
+      else:
+        deleted.add(messageId)
+      labelChanges.pop(messageId, None)
+    for historyType, addKey, removeKey in [('labelsAdded', 'labelsAdded', 'labelsRemoved'),
+                                           ('labelsRemoved', 'labelsRemoved', 'labelsAdded')]:
+      for item in record.get(historyType, []):
+        messageId = item['message']['id']
+        if messageId in added or messageId in deleted:
+          continue
+        changes = labelChanges.setdefault(messageId, {'labelsAdded': set(), 'labelsRemoved': set()})
+        for labelId in item.get('labelIds', []):
+          changes[addKey].add(labelId)
+          changes[removeKey].discard(labelId)
+
+  def _listHistory(self, gmail, startHistoryId, labelId):
+    added = set()
+    deleted = set()
+    labelChanges = {}
+    historyId = startHistoryId
+    kwargs = {'labelId': labelId} if labelId else {}
+    while True:
+      result = callGAPI(gmail.users().history(), 'list',
+                        throwReasons=GAPI.GMAIL_THROW_REASONS+[GAPI.NOT_FOUND],
+                        userId='me', startHistoryId=startHistoryId, maxResults=GMAIL_HISTORY_SYNC_PAGE_SIZE, **kwargs)
+      for record in result.get('history', []):
+        self._applyHistory(record, added, deleted, labelChanges)
+      historyId = result.get('historyId', historyId)
+      pageToken = result.get('nextPageToken')
+      if not pageToken:
+        break
+      kwargs['pageToken'] = pageToken
+    labelChanges = {messageId: {key: sorted(labelIds) for key, labelIds in changes.items()}
+                    for messageId, changes in labelChanges.items() if changes['labelsAdded'] or changes['labelsRemoved']}
+    return {'full': False, 'historyId': historyId,
+            'added': sorted(added), 'deleted': sorted(deleted), 'labelChanges': labelChanges}
+
+  @staticmethod
+  def _getStartHistoryId(gmail):
+    return callGAPI(gmail.users(), 'getProfile',
+                    throwReasons=GAPI.GMAIL_THROW_REASONS,
+                    userId='me', fields='historyId')['historyId']
+
+  @staticmethod
+  def _listMessages(gmail, labelId, includeSpamTrash, historyId):
+    kwargs = {'labelIds': [labelId]} if labelId else {}
+    messages = callGAPIpages(gmail.users().messages(), 'list', 'messages',
+                             throwReasons=GAPI.GMAIL_THROW_REASONS,
+                             userId='me', includeSpamTrash=includeSpamTrash, maxResults=GMAIL_HISTORY_SYNC_PAGE_SIZE,
+                             fields='nextPageToken,messages(id)', **kwargs)
+    return {'full': True, 'historyId': historyId,
+            'added': [message['id'] for message in messages], 'deleted': [], 'labelChanges': {}}
+
+# Returns the changes to a mailbox since its last sync or an error message:
+# {'full': False, 'historyId': ..., 'added': [messageId, ...], 'deleted': [messageId, ...],
+#  'labelChanges': {messageId: {'labelsAdded': [labelId, ...], 'labelsRemoved': [labelId, ...]}}}
+# A message added and deleted since the last sync is omitted; label changes are not returned for added/deleted messages.
+# When a full resync was required, full is True and added lists all of the message IDs.
+# With commit=False the new historyId is not saved; call commit(mailbox, result['historyId']) when the changes have been processed
+  def sync(self, gapiGmailObj, labelId=None, includeSpamTrash=False, commit=True):
+    gmail = useGAPIServiceObject(gapiGmailObj)
+    mailbox = gapiGmailObj['user']
+    startHistoryId = self.getHistoryId(mailbox)
+    try:
+      result = _syncFromStartToken(startHistoryId, GAPI.notFound,
+                                  lambda startHistoryId: self._listHistory(gmail, startHistoryId, labelId),
+                                  lambda: self._getStartHistoryId(gmail),
+                                  lambda historyId: self._listMessages(gmail, labelId, includeSpamTrash, historyId))
+    except (GAPI.serviceNotAvailable, GAPI.badRequest) as e:
+      return str(e)
+    if commit:
+      self.commit(mailbox, result['historyId'])
+    return result
+
+# Gmail mailbox export; message IDs are listed a page at a time and the raw messages are fetched in batches,
+# numThreads batches at a time, and written in list order. The base64 raw message is decoded a chunk at a time.
+# mbox: the messages are written to one file, <outputPath>.ids records the ID and file length after each message;
+#       a resumed export truncates the mbox to the last recorded length and skips the recorded messages.
+# eml: each message is written to <outputPath>/<messageId>.eml; a resumed export skips the existing files
+GMAIL_EXPORT_BATCH_SIZE = 10
+GMAIL_EXPORT_DECODE_CHUNK_SIZE = 4*1024*1024
+GMAIL_EXPORT_FORMATS = {'mbox', 'eml'}
+GMAIL_EXPORT_MBOX_FROM_PATTERN = re.compile(rb'^(>*From )', re.MULTILINE)
+
+def _yieldGmailRawBytes(raw):
+  for i in range(0, len(raw), GMAIL_EXPORT_DECODE_CHUNK_SIZE):
+    chunk = raw[i:i+GMAIL_EXPORT_DECODE_CHUNK_SIZE]
+    yield base64.urlsafe_b64decode(chunk+'='*(-len(chunk)%4))
+
+def _writeGmailMboxMessage(f, message):
+  f.write(f"From MAILER-DAEMON {time.asctime(time.gmtime(int(message.get('internalDate', 0))/1000))}\n".encode(UTF8))
+  carry = b''
+  for data in _yieldGmailRawBytes(message['raw']):
+    data = carry+data
+    end = data.rfind(b'\n')+1
+    f.write(GMAIL_EXPORT_MBOX_FROM_PATTERN.sub(rb'>\1', data[:end]))
+    carry = data[end:]
+  if carry:
+    f.write(GMAIL_EXPORT_MBOX_FROM_PATTERN.sub(rb'>\1', carry)+b'\n')
+  f.write(b'\n')
+
+def _writeGmailEmlMessage(outputPath, message):
+  fileName = os.path.join(outputPath, f"{message['id']}.eml")
+  tempFileName = f'{fileName}.tmp'
+  with open(tempFileName, 'wb') as f:
+    for data in _yieldGmailRawBytes(message['raw']):
+      f.write(data)
+  os.replace(tempFileName, fileName)
+
+# Returns the IDs recorded in the mbox IDs file and truncates the mbox to the last recorded length
+def _resumeGmailMboxExport(mboxFile, idsFile):
+  exportedIds = set()
+  length = 0
+  idsLength = 0
+  f = openFile(idsFile, 'rb', continueOnError=True, displayError=False)
+  if f:
+    for line in f:
+      fields = line.split()
+      if not line.endswith(b'\n') or len(fields) != 2 or not fields[1].isdigit():
+        break
+      exportedIds.add(fields[0].decode(UTF8))
+      length = int(fields[1])
+      idsLength += len(line)
+    closeFile(f)
+    os.truncate(idsFile, idsLength)
+  if os.path.isfile(mboxFile):
+    os.truncate(mboxFile, length)
+  return exportedIds
+
+def _getGmailRawMessages(gapiGmailObj, messageIds):
+  gmail = useGAPIServiceObject(gapiGmailObj)
+  requests = [(messageId, gmail.users().messages().get(userId='me', id=messageId, format='raw', fields='id,internalDate,raw'))
+              for messageId in messageIds]
+  return callGAPIbatch(gmail, requests, batchSize=len(messageIds))
+
+# Export the messages selected by kwargs (q, labelIds, includeSpamTrash) to an mbox file or a directory of eml files.
+# Returns {'exported': <Number>, 'skipped': <Number>, 'errors': {messageId: <Message>}} or an error message
+# if the messages can not be listed; the messages exported before the error are kept
+def GmailMessagesExport(gapiGmailObj, outputPath, outputFormat='mbox',
+                        numThreads=None, batchSize=None, resume=True, **kwargs):
+  import concurrent.futures
+
+  if outputFormat not in GMAIL_EXPORT_FORMATS:
+    return f'{Msg.INVALID} outputFormat: {outputFormat}'
+  outputPath = os.path.expanduser(outputPath)
+  numThreads = numThreads or GC.Values[GC.NUM_THREADS]
+  batchSize = batchSize or GMAIL_EXPORT_BATCH_SIZE
+  mboxFile = idsFile = None
+  if outputFormat == 'mbox':
+    idsFileName = f'{outputPath}.ids'
+    exportedIds = _resumeGmailMboxExport(outputPath, idsFileName) if resume else set()
+    mboxFile = openFile(outputPath, 'ab' if resume else 'wb', continueOnError=True)
+    idsFile = openFile(idsFileName, DEFAULT_FILE_APPEND_MODE if resume else DEFAULT_FILE_WRITE_MODE, encoding=UTF8, continueOnError=True)
+    if not mboxFile or not idsFile:
+      return f'{Msg.INVALID} outputPath: {outputPath}'
+  else:
+    os.makedirs(outputPath, exist_ok=True)
+    exportedIds = {fileName[:-4] for fileName in os.listdir(outputPath) if fileName.endswith('.eml')} if resume else set()
+  counts = {'exported': 0, 'skipped': 0, 'errors': {}}
+  listError = None
+
+  def _writeBatch(messageIds, future):
+    result = future.result()
+    if isinstance(result, str):
+      results, errors = {}, {messageId: (0, None, result) for messageId in messageIds}
+    else:
+      results, errors = result
+    exported = []
+    for messageId in messageIds:
+      message = results.pop(messageId, None)
+      if message is None:
+        http_status, reason, errorMessage = errors[messageId]
+        counts['errors'][messageId] = errorMessage or formatHTTPError(http_status, reason, errorMessage)
+        continue
+      if mboxFile:
+        _writeGmailMboxMessage(mboxFile, message)
+        exported.append(f'{messageId} {mboxFile.tell()}\n')
+      else:
+        _writeGmailEmlMessage(outputPath, message)
+      counts['exported'] += 1
+    if mboxFile and exported:
+      mboxFile.flush()
+      os.fsync(mboxFile.fileno())
+      idsFile.write(''.join(exported))
+      idsFile.flush()
+
+  def _submitBatch(messageIds):
+    window.append((messageIds, submitInSession(executor, session, callWithPooledGAPIObject, pool, gapiGmailObj,
+                                               _getGmailRawMessages, messageIds)))
+
+# gapiGmailObj lists the messages, the batches are fetched with pooled gapiObjs
+  session = getCurrentSession()
+  pool = GAPIObjectPool()
+  window = collections.deque()
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+      messageIds = []
+      for message in GmailMessagesYield(gapiGmailObj, fields='id', **kwargs):
+        if isinstance(message, str):
+          listError = message
+          break
+        if message['id'] in exportedIds:
+          counts['skipped'] += 1
+          continue
+        messageIds.append(message['id'])
+        if len(messageIds) < batchSize:
+          continue
+        _submitBatch(messageIds)
+        messageIds = []
+        if len(window) >= numThreads:
+          _writeBatch(*window.popleft())
+      if messageIds:
+        _submitBatch(messageIds)
+      while window:
+        _writeBatch(*window.popleft())
+  finally:
+    if mboxFile:
+      closeFile(mboxFile, forceFlush=True)
+      closeFile(idsFile, forceFlush=True)
+  if listError:
+    return listError
+  return counts
@@ -98,8 +98,12 @@ CUSTOMER_ID = 'customer_id'
 DEBUG_LEVEL = 'debug_level'
 # When retrieving lists of ChromeOS devices from API, how many should be retrieved in each chunk
 DEVICE_MAX_RESULTS = 'device_max_results'
+# How many seconds cached directory maps (org units, roles, buildings, user IDs) are used before being refreshed
+DIRECTORY_CACHE_TTL = 'directory_cache_ttl'
 # Domain obtained from gam.cfg or oauth2.txt
 DOMAIN = 'domain'
+# Size in MB of the ranges of media downloads
+DOWNLOAD_CHUNK_SIZE = 'download_chunk_size'
 # Google Drive download directory
 DRIVE_DIR = 'drive_dir'
 # When retrieving lists of Drive files/folders from API, how many should be retrieved in each chunk
@@ -191,6 +195,8 @@ TODRIVE_TIMEFORMAT = 'todrive_timeformat'
 TODRIVE_TIMEZONE = 'todrive_timezone'
 # User for todrive files
 TODRIVE_USER = 'todrive_user'
+# Size in MB of the chunks of resumable media uploads
+UPLOAD_CHUNK_SIZE = 'upload_chunk_size'
 # When retrieving lists of Users from API, how many should be retrieved in each chunk
 USER_MAX_RESULTS = 'user_max_results'
 # User service account access only, no client access
@@ -223,7 +229,9 @@ Defaults = {
   CUSTOMER_ID: MY_CUSTOMER,
   DEBUG_LEVEL: '0',
   DEVICE_MAX_RESULTS: '200',
+  DIRECTORY_CACHE_TTL: '3600',
   DOMAIN: '',
+  DOWNLOAD_CHUNK_SIZE: '20',
   DRIVE_DIR: '',
   DRIVE_MAX_RESULTS: '1000',
   DRIVE_V3_NATIVE_NAMES: TRUE,
@@ -269,6 +277,7 @@ Defaults = {
   TODRIVE_TIMEFORMAT: '',
   TODRIVE_TIMEZONE: '',
   TODRIVE_USER: '',
+  UPLOAD_CHUNK_SIZE: '100',
   USER_MAX_RESULTS: '500',
   USER_SERVICE_ACCOUNT_ACCESS_ONLY: FALSE,
   }
@@ -328,7 +337,9 @@ VAR_INFO = {
   CUSTOMER_ID: {VAR_TYPE: TYPE_STRING, VAR_ENVVAR: 'CUSTOMER_ID', VAR_LIMITS: (0, None)},
   DEBUG_LEVEL: {VAR_TYPE: TYPE_INTEGER, VAR_SIGFILE: 'debug.gam', VAR_LIMITS: (0, None), VAR_SFFT: ('0', '4')},
   DEVICE_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 200)},
+  DIRECTORY_CACHE_TTL: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (0, None)},
   DOMAIN: {VAR_TYPE: TYPE_STRING, VAR_ENVVAR: 'GA_DOMAIN', VAR_LIMITS: (0, None)},
+  DOWNLOAD_CHUNK_SIZE: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 1024)},
   DRIVE_DIR: {VAR_TYPE: TYPE_DIRECTORY, VAR_ENVVAR: 'GAMDRIVEDIR'},
   DRIVE_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 1000)},
   DRIVE_V3_NATIVE_NAMES: {VAR_TYPE: TYPE_BOOLEAN},
@@ -337,7 +348,7 @@ VAR_INFO = {
   EXTRA_ARGS: {VAR_TYPE: TYPE_FILE, VAR_SIGFILE: FN_EXTRA_ARGS_TXT, VAR_SFFT: ('', FN_EXTRA_ARGS_TXT), VAR_ACCESS: os.R_OK},
   INTER_BATCH_WAIT: {VAR_TYPE: TYPE_FLOAT, VAR_LIMITS: (0.0, 60.0)},
   MEMBER_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 200)},
-  MESSAGE_BATCH_SIZE: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 1000)},
+  MESSAGE_BATCH_SIZE: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 100)},
   MESSAGE_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 10000)},
   MOBILE_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 100)},
   NEVER_TIME: {VAR_TYPE: TYPE_STRING, VAR_LIMITS: (0, None)},
@@ -374,6 +385,7 @@ VAR_INFO = {
   TODRIVE_TIMEFORMAT: {VAR_TYPE: TYPE_STRING, VAR_LIMITS: (0, None)},
   TODRIVE_TIMEZONE: {VAR_TYPE: TYPE_STRING, VAR_LIMITS: (0, None)},
   TODRIVE_USER: {VAR_TYPE: TYPE_STRING, VAR_LIMITS: (0, None)},
+  UPLOAD_CHUNK_SIZE: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 1024)},
   USER_MAX_RESULTS: {VAR_TYPE: TYPE_INTEGER, VAR_LIMITS: (1, 500)},
   USER_SERVICE_ACCOUNT_ACCESS_ONLY: {VAR_TYPE: TYPE_BOOLEAN},
   }
@@ -76,6 +76,7 @@ GATEWAY_TIMEOUT = 'gatewayTimeout'
 GROUP_NOT_FOUND = 'groupNotFound'
 ILLEGAL_ACCESS_ROLE_FOR_DEFAULT = 'illegalAccessRoleForDefault'
 INSUFFICIENT_ADMINISTRATOR_PRIVILEGES = 'insufficientAdministratorPrivileges'
+INSUFFICIENT_ARCHIVED_USER_LICENSES = 'insufficientArchivedUserLicenses'
 INSUFFICIENT_FILE_PERMISSIONS = 'insufficientFilePermissions'
 INSUFFICIENT_PERMISSIONS = 'insufficientPermissions'
 INTERNAL_ERROR = 'internalError'
@@ -87,22 +87,44 @@ GAM_TYPE = 'gtyp'
 LAST_GOT_MSG_LEN = 'lgml'
 # File containing time of last GAM update check
 LAST_UPDATE_CHECK_TXT = 'lupc'
-# Make Building ID/Name map
+# Dictionary mapping map make flag to time when map expires
+MAP_EXPIRATIONS = 'mexp'
+# Make Building ID/Name and Calendar Resource maps
 MAKE_BUILDING_ID_NAME_MAP = 'mkbm'
 # Dictionary mapping Building ID to Name
 MAP_BUILDING_ID_TO_NAME = 'bi2n'
 # Dictionary mapping Building Name to ID
 MAP_BUILDING_NAME_TO_ID = 'bn2i'
+# Dictionary mapping Building ID to Building
+MAP_BUILDINGS = 'bmap'
+# Dictionary mapping Calendar Resource ID to Calendar Resource
+MAP_CALENDAR_RESOURCES = 'cmap'
+# Dictionary mapping Calendar Resource Email to ID
+MAP_CALENDAR_RESOURCE_EMAIL_TO_ID = 'ce2i'
 # Dictionary mapping OrgUnit ID to Name
 MAP_ORGUNIT_ID_TO_NAME = 'oi2n'
+# Make OrgUnit ID/Path map
+MAKE_ORGUNIT_ID_PATH_MAP = 'mkom'
+# Dictionary mapping OrgUnit ID to child OrgUnit IDs
+MAP_ORGUNIT_ID_TO_CHILD_IDS = 'oi2c'
+# Dictionary mapping lowercase OrgUnit Path to ID
+MAP_ORGUNIT_PATH_TO_ID = 'op2i'
+# Make Privilege map
+MAKE_PRIVILEGE_MAP = 'mkpm'
+# Dictionary mapping (Service ID, Privilege Name) to Privilege
+MAP_PRIVILEGES = 'pmap'
 # Make Role ID/Name map
 MAKE_ROLE_ID_NAME_MAP = 'mkrm'
 # Dictionary mapping Role ID to Name
 MAP_ROLE_ID_TO_NAME = 'ri2n'
 # Dictionary mapping Role Name to ID
 MAP_ROLE_NAME_TO_ID = 'rn2i'
+# Dictionary mapping Role ID to Role Privileges
+MAP_ROLE_ID_TO_PRIVILEGES = 'ri2p'
 # Dictionary mapping User ID to Name
 MAP_USER_ID_TO_NAME = 'ui2n'
+# Dictionary mapping lowercase User email to ID; the reverse of MAP_USER_ID_TO_NAME
+MAP_USER_EMAIL_TO_ID = 'ue2i'
 # Values retrieved from oauth2.txt
 OAUTH2_CLIENT_ID = 'oaci'
 # oauth2.txt lock file
@@ -194,14 +216,25 @@ Globals = {
   GAM_TYPE: '',
   LAST_GOT_MSG_LEN: 0,
   LAST_UPDATE_CHECK_TXT: '',
+  MAP_EXPIRATIONS: {},
   MAKE_BUILDING_ID_NAME_MAP: True,
   MAP_BUILDING_ID_TO_NAME: {},
   MAP_BUILDING_NAME_TO_ID: {},
+  MAP_BUILDINGS: {},
+  MAP_CALENDAR_RESOURCES: {},
+  MAP_CALENDAR_RESOURCE_EMAIL_TO_ID: {},
   MAP_ORGUNIT_ID_TO_NAME: {},
+  MAKE_ORGUNIT_ID_PATH_MAP: True,
+  MAP_ORGUNIT_ID_TO_CHILD_IDS: {},
+  MAP_ORGUNIT_PATH_TO_ID: {},
+  MAKE_PRIVILEGE_MAP: True,
+  MAP_PRIVILEGES: {},
   MAKE_ROLE_ID_NAME_MAP: True,
   MAP_ROLE_ID_TO_NAME: {},
   MAP_ROLE_NAME_TO_ID: {},
+  MAP_ROLE_ID_TO_PRIVILEGES: {},
   MAP_USER_ID_TO_NAME: {},
+  MAP_USER_EMAIL_TO_ID: {},
   OAUTH2_CLIENT_ID: None,
   OAUTH2_TXT_LOCK: None,
   OAUTH2SERVICE_CLIENT_ID: None,
@@ -75,10 +75,26 @@ else:
 
 DSTDIFF = DSTOFFSET - STDOFFSET
 
+# DST decisions and UTC offsets are cached per quarter hour; transitions never fall inside a window
+LOCAL_CACHE_MAX_SIZE = 65536
+
 class LocalTimezone(tzinfo):
   """Local time zone
 
   """
+  def __init__(self):
+    self._isdst_cache = {}
+    self._fromutc_cache = {}
+
+  def fromutc(self, dt):
+    key = (dt.year, dt.month, dt.day, dt.hour, dt.minute//15)
+    offset = self._fromutc_cache.get(key)
+    if offset is None:
+      offset = tzinfo.fromutc(self, dt)-dt
+      if len(self._fromutc_cache) >= LOCAL_CACHE_MAX_SIZE:
+        self._fromutc_cache.clear()
+      self._fromutc_cache[key] = offset
+    return dt+offset
 
   def utcoffset(self, dt):
     if self._isdst(dt):
@@ -96,12 +112,19 @@ class LocalTimezone(tzinfo):
     return _time.tzname[self._isdst(dt)]
 
   def _isdst(self, dt):
-    tt = (dt.year, dt.month, dt.day,
-          dt.hour, dt.minute, dt.second,
-          dt.weekday(), 0, 0)
-    stamp = _time.mktime(tt)
-    tt = _time.localtime(stamp)
-    return tt.tm_isdst > 0
+    key = (dt.year, dt.month, dt.day, dt.hour, dt.minute//15)
+    isdst = self._isdst_cache.get(key)
+    if isdst is None:
+      tt = (dt.year, dt.month, dt.day,
+            dt.hour, dt.minute, dt.second,
+            dt.weekday(), 0, 0)
+      stamp = _time.mktime(tt)
+      tt = _time.localtime(stamp)
+      isdst = tt.tm_isdst > 0
+      if len(self._isdst_cache) >= LOCAL_CACHE_MAX_SIZE:
+        self._isdst_cache.clear()
+      self._isdst_cache[key] = isdst
+    return isdst
 
 Local = LocalTimezone()
 
@@ -128,6 +151,23 @@ def parse_timezone_str(tzstring):
   groups = m.groupdict()
   return parse_timezone(groups)
    
+def is_fast_date(datestring):
+  """Checks for the fixed UTC shape returned by the Google APIs
+
+  YYYY-MM-DDTHH:MM:SSZ or YYYY-MM-DDTHH:MM:SS.fffZ
+
+  """
+  dlen = len(datestring)
+  if dlen == 20:
+    pass
+  elif dlen == 24:
+    if datestring[19] != '.' or not datestring[20:23].isdigit():
+      return False
+  else:
+    return False
+  return (datestring[23 if dlen == 24 else 19] == 'Z' and datestring[10] == 'T' and
+          datestring[4] == '-' and datestring[7] == '-' and datestring[13] == ':' and datestring[16] == ':')
+
 def parse_date(datestring):
   """Parses ISO 8601 dates into datetime objects
 
@@ -142,6 +182,11 @@ def parse_date(datestring):
            constructing the datetime instance.
 
   """
+  if is_fast_date(datestring):
+    try:
+      return (datetime.fromisoformat(datestring[:19]).replace(tzinfo=UTC), UTC)
+    except ValueError:
+      pass
   m = ISO8601_REGEX.match(datestring)
   if not m:
     raise ParseError("Unable to parse date string %r" % datestring)
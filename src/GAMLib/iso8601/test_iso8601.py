@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Tests and benchmark for the ISO 8601 fast path and local time zone caches
+
+Run with pytest or as a script; as a script the benchmark is also run.
+"""
+
+from datetime import (datetime, timedelta, tzinfo)
+import importlib
+import os
+import sys
+import time as _time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from iso8601 import iso8601 #pylint: disable=wrong-import-position
+
+# Zones with DST, a 30 minute DST change, a :30 and a :45 offset
+DST_TIMEZONES = ['America/New_York', 'Europe/London', 'America/St_Johns', 'Asia/Kathmandu', 'Australia/Lord_Howe']
+DST_YEARS = [2020, 2021]
+
+def make_date_corpus():
+  corpus = []
+  dt = datetime(1970, 1, 1)
+  while dt.year < 2038:
+    corpus.append(dt.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    corpus.append(dt.strftime('%Y-%m-%dT%H:%M:%S.')+f'{dt.microsecond//1000:03d}Z')
+    dt += timedelta(hours=7, minutes=13, seconds=17, milliseconds=389)
+  corpus.extend(['2020-02-29T23:59:59Z', '2020-02-29T23:59:59.999Z', '2000-01-01T00:00:00.000Z',
+# Invalid dates in the fast shape fall back to the regex path
+                 '2021-02-29T00:00:00Z', '2021-13-01T00:00:00.000Z', '2021-01-01T24:00:00Z', '2021-01-01T00:60:00Z',
+# Not the fast shape
+                 '2021-01-01T00:00:00+05:45', '2021-01-01T00:00:00-03:30', '2021-01-01 00:00:00Z',
+                 '2021-01-01T00:00:00,123Z', '2021-01-01T00:00:00.1Z', '2021-01-01T00:00:00.123456Z',
+                 '2021-01-01T00:00:00.12xZ', '2021-01-01T00:00:00.123+00:00', '2021-01-01T00:00:00',
+                 '2021-01-01X00:00:00Z', '2021/01/01T00:00:00Z', '2021-01-01T00:00:00z', ''])
+  return corpus
+
+def parse_slow(datestring):
+  fast = iso8601.is_fast_date
+  iso8601.is_fast_date = lambda datestring: False
+  try:
+    return iso8601.parse_date(datestring)
+  finally:
+    iso8601.is_fast_date = fast
+
+def parse_result(parse, datestring):
+  try:
+    dt, tz = parse(datestring)
+    return (dt, dt.utcoffset(), tz.utcoffset(None), tz.tzname(None))
+  except iso8601.ParseError:
+    return iso8601.ParseError
+
+def test_parse_date_fast_path_matches_regex_path():
+  for datestring in make_date_corpus():
+    assert parse_result(iso8601.parse_date, datestring) == parse_result(parse_slow, datestring), datestring
+
+class UncachedLocalTimezone(iso8601.LocalTimezone):
+  """LocalTimezone without the quarter hour caches
+
+  """
+  def fromutc(self, dt):
+    return tzinfo.fromutc(self, dt)
+
+  def _isdst(self, dt):
+    tt = (dt.year, dt.month, dt.day,
+          dt.hour, dt.minute, dt.second,
+          dt.weekday(), 0, 0)
+    stamp = _time.mktime(tt)
+    tt = _time.localtime(stamp)
+    return tt.tm_isdst > 0
+
+def set_timezone(timezone):
+  if timezone is None:
+    os.environ.pop('TZ', None)
+  else:
+    os.environ['TZ'] = timezone
+  _time.tzset()
+# STDOFFSET/DSTOFFSET are set when the module is loaded
+  importlib.reload(iso8601)
+
+# Returns the UTC times of the DST transitions in year, found hourly and refined to the minute
+def find_transitions(year):
+  transitions = []
+  stamp = int(datetime(year, 1, 1, tzinfo=iso8601.UTC).timestamp())
+  end = int(datetime(year+1, 1, 1, tzinfo=iso8601.UTC).timestamp())
+  isdst = _time.localtime(stamp).tm_isdst
+  while stamp < end:
+    nextStamp = stamp+3600
+    if _time.localtime(nextStamp).tm_isdst != isdst:
+      while _time.localtime(stamp+60).tm_isdst == isdst:
+        stamp += 60
+      transitions.append(datetime.fromtimestamp(stamp+60, iso8601.UTC))
+      isdst = _time.localtime(nextStamp).tm_isdst
+    stamp = nextStamp
+  return transitions
+
+def check_local_timezone_caches():
+  cached = iso8601.LocalTimezone()
+  uncached = UncachedLocalTimezone()
+  transitions = [transition for year in DST_YEARS for transition in find_transitions(year)]
+  if _time.daylight:
+    assert transitions
+  for transition in transitions:
+    for minutes in range(-180, 181, 5):
+      utc = transition+timedelta(minutes=minutes, seconds=minutes % 60)
+      local = utc.astimezone(cached)
+      assert local.replace(tzinfo=None) == utc.astimezone(uncached).replace(tzinfo=None), utc
+      assert local.utcoffset() == local.replace(tzinfo=uncached).utcoffset(), utc
+      assert local.tzname() == local.replace(tzinfo=uncached).tzname(), utc
+# Wall times around the transition, including nonexistent and repeated times
+      wall = (transition+timedelta(minutes=minutes)).replace(tzinfo=None)+iso8601.STDOFFSET
+      assert wall.replace(tzinfo=cached).utcoffset() == wall.replace(tzinfo=uncached).utcoffset(), wall
+      assert wall.replace(tzinfo=cached).dst() == wall.replace(tzinfo=uncached).dst(), wall
+
+def test_local_timezone_caches_at_dst_transitions():
+  if not hasattr(_time, 'tzset'):
+    return
+  timezone = os.environ.get('TZ')
+  try:
+    for dstTimezone in DST_TIMEZONES:
+      set_timezone(dstTimezone)
+      check_local_timezone_caches()
+  finally:
+    set_timezone(timezone)
+
+def benchmark(count=100000):
+  corpus = [datestring for datestring in make_date_corpus() if iso8601.is_fast_date(datestring)][:count]
+  local = iso8601.LocalTimezone()
+  uncached = UncachedLocalTimezone()
+  for name, parse, tz in [('regex', parse_slow, uncached), ('fast', iso8601.parse_date, local)]:
+    start = _time.perf_counter()
+    for datestring in corpus:
+      parse(datestring)
+    parseTime = _time.perf_counter()-start
+    start = _time.perf_counter()
+    for datestring in corpus:
+      parse(datestring)[0].astimezone(tz).isoformat()
+    print(f'{name}: {len(corpus)} parse_date {parseTime:.2f}s, parse_date+astimezone(Local) {_time.perf_counter()-start:.2f}s')
+
+if __name__ == '__main__':
+  test_parse_date_fast_path_matches_regex_path()
+  test_local_timezone_caches_at_dst_transitions()
+  print('OK')
+  benchmark()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Test GAMLite checkGAPIError against a corpus of error bodies and benchmark it
+
+python gapierrortest.py - compare the results with gapierrors.jsonl
+python gapierrortest.py --update - rewrite gapierrors.jsonl with the current results; review the diff
+"""
+
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+# Move the GAMLib directory wherever you like, set that path in the following line
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__))+'/GAMLib')
+from gam import gam
+from gamlib import glcfg as GC
+import httplib2
+
+CORPUS_FILE = os.path.dirname(os.path.realpath(__file__))+'/gapierrors.jsonl'
+
+# JSON error bodies: each code and message with each status and with each reason
+CODES = [400, 403, 404, 409, 412, 429, 500, 502, 503, 504]
+MESSAGES = [
+  'Backend Error', 'Internal error encountered.', 'Role assignment exists: roleAssignment', 'Role assignment exists: roleId 123',
+  'Operation not supported', 'Failed status in update settings response', '', 'Bad Gateway', 'The service is currently unavailable.',
+  'Quota exceeded for the current request', 'quota exceeded for the current request', 'Gateway Timeout', '@AttachmentNotVisible',
+  'Precondition check failed.', 'Invalid value', 'does not match', 'The caller does not have permission',
+  'Permission iam.serviceAccountKeys.create denied', 'Requested entity was not found.', 'Resource does not exist',
+  'Requested entity already exists', 'Insufficient archived user licenses', 'Quota exceeded for quota metric', 'Something else',
+  'Not Found', 'Resource Not Found: userKey', 'Invalid Input: User message: ""',
+  'Invalid sharing request. User message: "Sharing is disabled"',
+  ]
+STATUSES = ['', 'INTERNAL', 'UNAVAILABLE', 'FAILED_PRECONDITION', 'INVALID_ARGUMENT', 'PERMISSION_DENIED', 'NOT_FOUND',
+            'ALREADY_EXISTS', 'RESOURCE_EXHAUSTED']
+REASONS = ['someReason', 'notFound', 'invalid', 'invalidSharingRequest', 'forbidden']
+# Non-JSON error contents: each code and content with softErrors/retryOnHttpError
+CONTENTS = [
+  'Request rate higher than configured', 'Quota exceeded for quota metric x', 'bad gateway', 'Quota exceeded for the current request',
+  'quota exceeded for the current request', 'gateway timeout', 'invalidSsoSigningKey', 'UnknownError', 'featureUnavailableForUser',
+  'EntityDoesNotExist', 'EntityNameNotValid', 'Failed to parse Content-Range header', 'Request contains an invalid argument',
+  'invalid domain.', 'domain cannot use apis.', 'not found', 'bad request', '<!DOCTYPE html><title>Not Found</title>',
+  '<!DOCTYPE html><title>Bad Request</title>', '<!DOCTYPE html><p>no title</p>', 'zzz',
+  ]
+
+def makeBody(code, message, variant):
+  error = {'code': code, 'message': message}
+  kind, value = variant.split('=')
+  if kind == 'reason':
+    error['errors'] = [{'reason': value, 'message': message}]
+  elif value:
+    error['status'] = value
+  return json.dumps({'error': error})
+
+# Yields (code, message or content, variant, content, kwargs)
+def makeCases():
+  for code in CODES:
+    for message in MESSAGES:
+      for variant in [f'status={status}' for status in STATUSES]+[f'reason={reason}' for reason in REASONS]:
+        content = makeBody(code, message, variant)
+        yield (code, message, variant, content, {'mapNotFound': True})
+        yield (code, message, variant+';mapNotFound=false', content, {'mapNotFound': False})
+  for code in CODES:
+    for content in CONTENTS:
+      for softErrors, retryOnHttpError in itertools.product([False, True], [False, True]):
+        yield (code, content, f'softErrors={str(softErrors).lower()};retryOnHttpError={str(retryOnHttpError).lower()}',
+               content, {'softErrors': softErrors, 'retryOnHttpError': retryOnHttpError})
+
+# Returns [http_status, reason, message], ['exit', rc] or [0, None, None]; the message is None when it is unchanged
+# and any error message written to stderr is appended
+def checkError(code, message, content, kwargs):
+  e = gam.googleapiclient.errors.HttpError(httplib2.Response({'status': str(code)}), content.encode('utf-8'))
+  stderr = io.StringIO()
+  with contextlib.redirect_stderr(stderr):
+    try:
+      result = list(gam.checkGAPIError(e, **kwargs))
+      if len(result) == 3 and result[2] == message:
+        result[2] = None
+    except SystemExit as x:
+      result = ['exit', x.code]
+  if stderr.getvalue().strip():
+    result.append(stderr.getvalue().strip())
+  return result
+
+def getResults():
+  results = {}
+  for code, message, variant, content, kwargs in makeCases():
+    results.setdefault((code, message), {})[variant] = checkError(code, message, content, kwargs)
+  return results
+
+def main():
+  GC.Values.setdefault(GC.DEBUG_LEVEL, 0)
+  gam.GAPI_ERROR_RESULTS.clear()
+  results = getResults()
+  if sys.argv[1:] == ['--update']:
+    with open(CORPUS_FILE, 'w', encoding='utf-8') as f:
+      for (code, message), variants in results.items():
+# mapNotFound=false results are only kept when they differ
+        variants = {variant: result for variant, result in variants.items()
+                    if not variant.endswith(';mapNotFound=false') or result != variants[variant.split(';')[0]]}
+        f.write(json.dumps({'code': code, 'message': message, 'results': variants}, ensure_ascii=False)+'\n')
+    print(f'Updated: {CORPUS_FILE}')
+    return 0
+  failed = 0
+  unchecked = dict(results)
+  with open(CORPUS_FILE, 'r', encoding='utf-8') as f:
+    for line in f:
+      record = json.loads(line)
+      variants = unchecked.pop((record['code'], record['message']), {})
+      for variant, result in variants.items():
+        expected = record['results'].get(variant, record['results'].get(variant.split(';')[0]))
+        if result != expected:
+          failed += 1
+          print(f'ERROR: {record["code"]} {record["message"]!r} {variant}: {result}, expected {expected}')
+  for code, message in unchecked:
+    failed += 1
+    print(f'ERROR: {code} {message!r}: not in {CORPUS_FILE}')
+# The results are memoized, check them again
+  if getResults() != results:
+    failed += 1
+    print('ERROR: memoized results differ')
+  if failed:
+    return 1
+  print('OK: results match the corpus')
+  cases = list(makeCases())
+# An error storm repeats a few error bodies
+  storm = [case for case in cases if case[4].get('retryOnHttpError', True)][:20]*(len(cases)//20)
+  for name, clear, benchmarkCases in [('classify', True, cases), ('error storm', False, storm)]:
+    start = time.perf_counter()
+    for code, message, _, content, kwargs in benchmarkCases:
+      if clear:
+        gam.GAPI_ERROR_RESULTS.clear()
+      e = gam.googleapiclient.errors.HttpError(httplib2.Response({'status': str(code)}), content.encode('utf-8'))
+      with contextlib.redirect_stderr(io.StringIO()):
+        try:
+          gam.checkGAPIError(e, **kwargs)
+        except SystemExit:
+          pass
+    print(f'{name}: {len(benchmarkCases)} errors {time.perf_counter()-start:.3f}s')
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Test that importing GAMLite does not import the modules that it imports when first needed
+and that the import time of gam is under a limit
+
+Run with pytest or as a script; as a script the import time is also printed.
+"""
+
+import os
+import subprocess
+import sys
+
+# Move the GAMLib directory wherever you like, set that path in the following line
+GAMLIB_PATH = os.path.dirname(os.path.realpath(__file__))+'/GAMLib'
+
+# Modules that gam imports when first needed and that its required packages do not import
+DEFERRED_MODULES = [
+  'distro',
+  'filelock',
+  'google.auth.jwt',
+  'google.oauth2.credentials',
+  'google.oauth2.id_token',
+  'google.oauth2.service_account',
+  'googleapiclient.discovery',
+  'googleapiclient.http',
+  'numpy',
+  'socketserver',
+  'sqlite3',
+  ]
+# Cumulative import time limit of gam.gam in milliseconds; set GAM_IMPORT_TIME_LIMIT_MS to override it
+IMPORT_TIME_LIMIT_MS = int(os.environ.get('GAM_IMPORT_TIME_LIMIT_MS', '1000'))
+
+# Import gam in a new interpreter with -X importtime; its report lists every module imported as:
+# import time: <self us> | <cumulative us> | <indented module name>
+# Returns {module: cumulative us}
+def get_import_times():
+  result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           f'import sys; sys.path.insert(0, {GAMLIB_PATH!r}); from gam import gam'],
+                          capture_output=True, text=True, check=False)
+  assert result.returncode == 0, result.stderr
+  imported = {}
+  for line in result.stderr.splitlines():
+    if line.startswith('import time:') and '|' in line:
+      _, cumulative, name = line[len('import time:'):].split('|')
+      if cumulative.strip().isdigit():
+        imported[name.strip()] = int(cumulative)
+  return imported
+
+def test_deferred_modules_not_imported():
+  imported = get_import_times()
+  assert [module for module in DEFERRED_MODULES if module in imported] == []
+
+def test_import_time_under_limit():
+  imported = get_import_times()
+  assert imported['gam.gam']/1000 <= IMPORT_TIME_LIMIT_MS, f'gam.gam: {imported["gam.gam"]/1000:.1f}ms'
+
+if __name__ == '__main__':
+  importTimes = get_import_times()
+  print(f'gam.gam: {importTimes["gam.gam"]/1000:.1f}ms, limit {IMPORT_TIME_LIMIT_MS}ms, {len(importTimes)} modules')
+  test_deferred_modules_not_imported()
+  test_import_time_under_limit()
+  print('OK')